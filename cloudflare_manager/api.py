@@ -1,6 +1,18 @@
-from typing import Optional
+from collections import defaultdict
+import threading
+import time
+from typing import Callable, Optional
+from .cache import MISSING, PersistentCache
 from .cloudflare_api import CloudflareApi
 
+NEGATIVE_CACHE_TTL = 60
+# shared by every tunnel without an ingress; treat as read-only
+CATCH_ALL_INGRESS = {'service': 'http_status:404'}
+
+
+def without_record_ids(records: dict) -> dict:
+    return {name: {k: v for k, v in record.items() if k != 'id'} for name, record in records.items()}
+
 
 class Api:
     def __init__(self, cf: CloudflareApi):
@@ -10,11 +22,14 @@ class Api:
     def cf(self):
         return self._cf
 
-    def get_zone_id(self, name: str) -> str:
-        zone_id = self._cf.get_zone_id(name)
-        if not zone_id:
+    def get_zone(self, name: str) -> dict:
+        zone = self._cf.get_zone(name)
+        if not zone:
             raise Exception(f'Could not find zone name "{name}"')
-        return zone_id
+        return zone
+
+    def get_zone_id(self, name: str) -> str:
+        return self.get_zone(name)['id']
 
     def get_dns_record_id(self, zone_id: str, name: str) -> Optional[str]:
         return self._cf.get_dns_record_id(zone_id, name)
@@ -29,34 +44,132 @@ class Api:
         tunnel_ingress = self._cf.get_tunnel_configs(account_id, tunnel_id)
         if tunnel_ingress is None:
             raise Exception(f'Could not find tunnel ingress for account "{account_id}" and tunnel "{tunnel_id}"')
-        return (tunnel_ingress.get('config') or {}).get('ingress') or [{'service': 'http_status:404'}]
+        return (tunnel_ingress.get('config') or {}).get('ingress') or [CATCH_ALL_INGRESS]
+
+    def invalidate_dns_records(self, zone_id: str):
+        pass
 
 
 class CachedApi(Api):
-    def __init__(self, cf: CloudflareApi):
+    # The tunnel ingress is not cached: it can be edited from the dashboard and every PUT replaces it whole.
+    def __init__(self, cf: CloudflareApi, store: Optional[PersistentCache] = None, ttl: Optional[float] = None):
         super().__init__(cf)
-        self._zone_name_to_id: dict[str, str] = {}
-        self._dns_records_by_zone_id: dict = {}
-        self._tunnel_config_cache: dict[tuple[str, str], str] = {}
+        self._store = store
+        self._ttl = ttl
+        self._expires: dict[tuple, tuple[dict, object, float]] = {}
+        self._zones_by_name: dict[str, dict] = {}
+        self._dns_records_by_zone_id: dict[str, dict] = {}
         self._dns_record_id_cache: dict[tuple[str, str], str] = {}
+        self._failures: dict[tuple, tuple[type, tuple, float]] = {}
+        self._locks: defaultdict[tuple, threading.Lock] = defaultdict(threading.Lock)
+        self._locks_guard = threading.Lock()
+        self._zones_loaded = False
+        self._zones_loaded_expires: Optional[float] = None
 
-    def get_zone_id(self, name: str) -> str:
-        return self._get_from_cache(self._zone_name_to_id, super().get_zone_id, name)
+    def get_zone(self, name: str) -> dict:
+        zone = self._zones_by_name.get(name)
+        if zone is not None:
+            return zone
+        if not self._zones_loaded:
+            self._load_zones()
+        return self._get_from_cache(self._zones_by_name, super().get_zone, name, key=name,
+                                    negative_ttl=NEGATIVE_CACHE_TTL)
+
+    def _load_zones(self):
+        with self._get_lock(('get_zones',)):
+            if self._zones_loaded:
+                return
+            zones = self._cf.get_zones()
+            if zones is not None:
+                for zone in zones:
+                    if zone['name'] not in self._zones_by_name:
+                        self._set_cache(self._zones_by_name, 'get_zone', (zone['name'],), zone['name'], zone)
+            self._zones_loaded = True
+            if self._ttl is not None:
+                self._zones_loaded_expires = time.monotonic() + self._ttl
 
     def get_dns_record_id(self, zone_id: str, name: str) -> str:
-        return self._get_from_cache(self._dns_record_id_cache, super().get_dns_record_id, zone_id, name)
+        record = self._dns_records_by_zone_id.get(zone_id, {}).get(name)
+        if record and record.get('id'):
+            return record['id']
+        # record ids are invalidated per name, so a persisted id could outlive the record; keep them in memory only
+        return self._get_from_cache(self._dns_record_id_cache, super().get_dns_record_id, zone_id, name,
+                                    persist=False)
 
     def get_dns_records(self, zone_id: str) -> dict:
-        return self._get_from_cache(self._dns_records_by_zone_id, super().get_dns_records, zone_id)
+        records = self._dns_records_by_zone_id.get(zone_id)
+        if records is not None:
+            return records
+        # a persisted id could outlive its record; without one, Zone looks the id up again before deleting
+        return self._get_from_cache(self._dns_records_by_zone_id, super().get_dns_records, zone_id, key=zone_id,
+                                    negative_ttl=NEGATIVE_CACHE_TTL, to_store=without_record_ids)
 
-    def get_tunnel_ingress(self, account_id: str, tunnel_id: str) -> list:
-        return self._get_from_cache(self._tunnel_config_cache, super().get_tunnel_ingress, account_id, tunnel_id)
-
-    @staticmethod
-    def _get_from_cache(cache: dict, func, *keys):
-        if keys in cache:
-            val = cache[keys]
-        else:
-            val = func(*keys)
-            cache[keys] = val
+    def invalidate_dns_records(self, zone_id: str):
+        self._invalidate(self._dns_records_by_zone_id, 'get_dns_records', zone_id, key=zone_id)
+        for keys in [keys for keys in list(self._dns_record_id_cache) if keys[0] == zone_id]:
+            self._invalidate(self._dns_record_id_cache, 'get_dns_record_id', *keys)
+
+    def clear(self):
+        for cache in (self._zones_by_name, self._dns_records_by_zone_id, self._dns_record_id_cache, self._expires,
+                      self._failures):
+            cache.clear()
+        self._zones_loaded = False
+        self._zones_loaded_expires = None
+
+    def expire(self):
+        now = time.monotonic()
+        for lock_key, (cache, key, expires) in list(self._expires.items()):
+            if expires <= now:
+                cache.pop(key, None)
+                del self._expires[lock_key]
+        if self._zones_loaded_expires is not None and self._zones_loaded_expires <= now:
+            self._zones_loaded = False
+            self._zones_loaded_expires = None
+
+    def _invalidate(self, cache: dict, method: str, *keys, key=None):
+        cache.pop(keys if key is None else key, None)
+        self._expires.pop((method,) + keys, None)
+        self._failures.pop((method,) + keys, None)
+        if self._store:
+            self._store.delete(method, keys)
+
+    def _get_lock(self, key: tuple) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks[key]
+
+    def _get_from_cache(self, cache: dict, func, *keys, key=None, negative_ttl: Optional[float] = None,
+                        persist: bool = True, to_store: Optional[Callable] = None):
+        if key is None:
+            key = keys
+        val = cache.get(key, MISSING)
+        if val is not MISSING:
+            return val
+        lock_key = (func.__name__,) + keys
+        with self._get_lock(lock_key):
+            val = cache.get(key, MISSING)
+            if val is not MISSING:
+                return val
+            failure = self._failures.get(lock_key)
+            if failure and failure[2] > time.monotonic():
+                # raise a fresh exception so the cached one does not collect a traceback on every hit
+                raise failure[0](*failure[1])
+            val = self._store.get(func.__name__, keys) if self._store and persist else MISSING
+            if val is MISSING:
+                try:
+                    val = func(*keys)
+                except Exception as exc:
+                    if negative_ttl:
+                        self._failures[lock_key] = (type(exc), exc.args, time.monotonic() + negative_ttl)
+                    raise
+            else:
+                persist = False
+            self._set_cache(cache, func.__name__, keys, key, val, persist=persist, to_store=to_store)
         return val
+
+    def _set_cache(self, cache: dict, method: str, keys: tuple, key, val, persist: bool = True,
+                   to_store: Optional[Callable] = None):
+        if self._store and persist:
+            self._store.set(method, keys, to_store(val) if to_store else val)
+        cache[key] = val
+        if self._ttl is not None:
+            self._expires[(method,) + keys] = (cache, key, time.monotonic() + self._ttl)
@@ -0,0 +1,56 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any
+
+try:
+    import orjson
+    dumps = orjson.dumps
+    loads = orjson.loads
+except ImportError:
+    dumps = json.dumps
+    loads = json.loads
+
+LOGGER = logging.getLogger('cf-mgr.cache')
+
+MISSING = object()
+
+
+class PersistentCache:
+    def __init__(self, path: str, ttl: float):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS cf_cache(k TEXT PRIMARY KEY, v BLOB, exp REAL)')
+        self._conn.execute('DELETE FROM cf_cache WHERE exp <= ?', (time.time(),))
+
+    @staticmethod
+    def _key(method: str, keys: tuple) -> str:
+        return json.dumps((method,) + keys)
+
+    def get(self, method: str, keys: tuple) -> Any:
+        with self._lock:
+            row = self._conn.execute('SELECT v, exp FROM cf_cache WHERE k = ?', (self._key(method, keys),)).fetchone()
+        if row is None or row[1] <= time.time():
+            return MISSING
+        try:
+            return loads(row[0])
+        except ValueError as exc:
+            LOGGER.warning('invalid cache entry for %s%s: %s', method, keys, exc)
+            return MISSING
+
+    def set(self, method: str, keys: tuple, val: Any):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO cf_cache(k, v, exp) VALUES (?, ?, ?)',
+                               (self._key(method, keys), dumps(val), time.time() + self._ttl))
+
+    def delete(self, method: str, keys: tuple):
+        with self._lock:
+            self._conn.execute('DELETE FROM cf_cache WHERE k = ?', (self._key(method, keys),))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,27 +1,157 @@
 from enum import Enum
 import logging
+import random
+import threading
+import time
 from typing import Optional
 
 import CloudFlare
+from requests import HTTPError, Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 LOGGER = logging.getLogger('cf-mgr.api')
 
+# the library raises a bare CloudFlareAPIError(429) when a 429 response has no json error body
+RATE_LIMIT_ERROR_CODES = {429, 971, 10100}
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+# Cloudflare allows 1200 requests per 5 minutes; stay a little under it
+REQUESTS_PER_PERIOD = 1100
+REQUEST_PERIOD = 300.0
+TUNNEL_CONFIG_PUTS_PER_SECOND = 1.0
+
+
+def get_retry_after(exc: Exception, headers=None) -> float:
+    response = getattr(exc, 'response', None)
+    if response is not None:
+        headers = response.headers
+    if not headers:
+        return 0
+    try:
+        return max(float(headers.get('Retry-After', 0)), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def is_retryable(exc: Exception, idempotent: bool = True) -> bool:
+    if isinstance(exc, CloudFlare.exceptions.CloudFlareAPIError):
+        return int(exc) in RATE_LIMIT_ERROR_CODES
+    if isinstance(exc, HTTPError) and exc.response is not None:
+        # a 5xx may have been returned after the request was applied, so only repeat calls that are safe to repeat
+        status_code = exc.response.status_code
+        return status_code in RETRY_STATUS_CODES and (idempotent or status_code == 429)
+    return False
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, rate: float):
+        self._capacity = capacity
+        self._rate = rate
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            LOGGER.debug('throttling cloudflare api call for %.2f seconds', wait)
+            time.sleep(wait)
+        return wait
+
 
 class DnsRecordType(Enum):
     A = 1
     CNAME = 2
 
 
+DNS_RECORD_TYPES = frozenset(typ.name for typ in DnsRecordType)
+# the largest per_page Cloudflare allows for each listing, so a shorter page is the last one
+DNS_RECORDS_PER_PAGE = 5000
+ZONES_PER_PAGE = 50
+# the batch endpoint accepts up to 200 changes per request on every plan
+DNS_BATCH_MAX = 200
+
+
 class CloudflareApi:
-    def __init__(self, token: str, debug=False):
+    def __init__(self, token: str, debug=False, pool_size: int = 10, retry_count: int = 4,
+                 retry_base_delay: float = 1.0):
         self._cf = CloudFlare.CloudFlare(token=token, debug=debug)
+        self._zones = self._cf.zones
+        self._dns_records = self._cf.zones.dns_records
+        self._cf.add('AUTH', 'zones', 'dns_records/batch')
+        self._dns_records_batch = self._cf.zones.dns_records.batch
+        self._tunnel_configs = self._cf.accounts.cfd_tunnel.configurations
+        self._retry_count = retry_count
+        self._retry_base_delay = retry_base_delay
+        self._bucket = TokenBucket(REQUESTS_PER_PERIOD, REQUESTS_PER_PERIOD / REQUEST_PERIOD)
+        self._tunnel_config_bucket = TokenBucket(1, TUNNEL_CONFIG_PUTS_PER_SECOND)
+        self._last_response = threading.local()
+        self._mount_session(pool_size)
+
+    def _mount_session(self, pool_size: int):
+        # the network object is private to the library and differs between releases and forks
+        network = getattr(getattr(self._cf, '_base', None), 'network', None)
+        if network is None or not hasattr(network, 'session'):
+            LOGGER.warning('cannot configure the cloudflare connection pool, using the library default session')
+            return
+        session = Session()
+        # 429 and 5xx responses are retried by _call_with_retry; the adapter only retries failed connections
+        retry = Retry(total=getattr(network, 'max_request_retries', 5), backoff_factor=0.2)
+        session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True,
+                                              max_retries=retry))
+        session.hooks['response'].append(self._remember_response)
+        network.session = session
 
-    def get_zone_id(self, zone_name: str) -> Optional[str]:
+    def _remember_response(self, response, *args, **kwargs):
+        # CloudFlareAPIError does not carry the response, so keep its headers around for the Retry-After delay
+        self._last_response.headers = response.headers
+
+    def _call_with_retry(self, func, *args, throttle: Optional[TokenBucket] = None, idempotent: bool = True,
+                         **kwargs):
+        attempt = 0
+        while True:
+            self._bucket.acquire()
+            if throttle:
+                throttle.acquire()
+            self._last_response.headers = None
+            try:
+                return func(*args, **kwargs)
+            except Exception as exc:
+                if attempt >= self._retry_count or not is_retryable(exc, idempotent):
+                    raise
+                retry_after = get_retry_after(exc, self._last_response.headers)
+                delay = max(retry_after, self._retry_base_delay * 2 ** attempt) + random.uniform(0, 0.25)
+                LOGGER.warning('%s - retrying in %.1f seconds', exc, delay)
+                time.sleep(delay)
+                attempt += 1
+
+    def get_zone(self, zone_name: str) -> Optional[dict]:
         try:
-            zones = self._cf.zones.get(params={'name': zone_name, 'per_page': 1})
+            zones = self._call_with_retry(self._zones.get, params={'name': zone_name, 'per_page': 1})
             if not zones:
                 return None
-            return zones[0]['id']
+            return zones[0]
+        except CloudFlare.exceptions.CloudFlareAPIError as exc:
+            LOGGER.error('/zones.get %d %s - cloudflare api call failed', exc, exc)
+        except Exception as exc:
+            LOGGER.error('/zones.get - %s - cloudflare api call failed', exc)
+        return None
+
+    def get_zones(self) -> Optional[list[dict]]:
+        try:
+            zones = []
+            page = 1
+            while True:
+                result = self._call_with_retry(self._zones.get, params={'per_page': ZONES_PER_PAGE, 'page': page})
+                zones.extend(result)
+                if len(result) < ZONES_PER_PAGE:
+                    return zones
+                page += 1
         except CloudFlare.exceptions.CloudFlareAPIError as exc:
             LOGGER.error('/zones.get %d %s - cloudflare api call failed', exc, exc)
         except Exception as exc:
@@ -30,7 +160,7 @@ class CloudflareApi:
 
     def get_tunnel_configs(self, account_id: str, tunnel_id: str) -> Optional[dict]:
         try:
-            return self._cf.accounts.cfd_tunnel.configurations.get(account_id, tunnel_id)
+            return self._call_with_retry(self._tunnel_configs.get, account_id, tunnel_id)
         except CloudFlare.exceptions.CloudFlareAPIError as exc:
             LOGGER.error('/accounts/cfd_tunnels/configurations.get %d %s - cloudflare api call failed', exc, exc)
         except Exception as exc:
@@ -39,8 +169,15 @@ class CloudflareApi:
 
     def get_dns_records(self, zone_id: str) -> Optional[list[dict]]:
         try:
-            records = self._cf.zones.dns_records.get(zone_id)
-            return [record for record in records if record['type'] in ['A', 'CNAME']]
+            records = []
+            page = 1
+            while True:
+                result = self._call_with_retry(self._dns_records.get, zone_id,
+                                               params={'per_page': DNS_RECORDS_PER_PAGE, 'page': page})
+                records.extend(record for record in result if record['type'] in DNS_RECORD_TYPES)
+                if len(result) < DNS_RECORDS_PER_PAGE:
+                    return records
+                page += 1
         except CloudFlare.exceptions.CloudFlareAPIError as exc:
             LOGGER.error('/zones/dns_records.get %d %s - cloudflare api call failed', exc, exc)
         except Exception as exc:
@@ -49,7 +186,8 @@ class CloudflareApi:
 
     def get_dns_record_id(self, zone_id: str, name: str) -> Optional[str]:
         try:
-            records = self._cf.zones.dns_records.get(zone_id, params={'name': name, 'per_page': 1})
+            records = self._call_with_retry(self._dns_records.get, zone_id,
+                                           params={'name': name, 'per_page': 1})
             if not records:
                 return None
             return records[0]['id']
@@ -61,12 +199,12 @@ class CloudflareApi:
 
     def create_dns_record(self, typ: DnsRecordType, zone_id: str, hostname: str, value: str, proxied: bool) -> bool:
         try:
-            self._cf.zones.dns_records.post(zone_id, data={
+            self._call_with_retry(self._dns_records.post, zone_id, data={
                 'type': typ.name,
                 'proxied': proxied,
                 'name': hostname,
                 'content': value,
-            })
+            }, idempotent=False)
         except CloudFlare.exceptions.CloudFlareAPIError as exc:
             LOGGER.error('/zones/dns_records.post %d %s - cloudflare api call failed', exc, exc)
             return False
@@ -77,7 +215,7 @@ class CloudflareApi:
 
     def delete_dns_record(self, zone_id: str, dns_record_id: str) -> bool:
         try:
-            self._cf.zones.dns_records.delete(zone_id, dns_record_id)
+            self._call_with_retry(self._dns_records.delete, zone_id, dns_record_id)
         except CloudFlare.exceptions.CloudFlareAPIError as exc:
             LOGGER.error('/zones/dns_records.delete %d %s - cloudflare api call failed', exc, exc)
             return False
@@ -86,9 +224,23 @@ class CloudflareApi:
             return False
         return True
 
+    def delete_dns_records(self, zone_id: str, dns_record_ids: list[str]) -> bool:
+        for ii in range(0, len(dns_record_ids), DNS_BATCH_MAX):
+            deletes = [{'id': dns_record_id} for dns_record_id in dns_record_ids[ii:ii + DNS_BATCH_MAX]]
+            try:
+                self._call_with_retry(self._dns_records_batch.post, zone_id, data={'deletes': deletes})
+            except CloudFlare.exceptions.CloudFlareAPIError as exc:
+                LOGGER.error('/zones/dns_records/batch.post %d %s - cloudflare api call failed', exc, exc)
+                return False
+            except Exception as exc:
+                LOGGER.error('/zones/dns_records/batch.post - %s - cloudflare api call failed', exc)
+                return False
+        return True
+
     def update_tunnel_configs(self, account_id: str, tunnel_id: str, data: dict) -> bool:
         try:
-            self._cf.accounts.cfd_tunnel.configurations.put(account_id, tunnel_id, data=data)
+            self._call_with_retry(self._tunnel_configs.put, account_id, tunnel_id, data=data,
+                                 throttle=self._tunnel_config_bucket)
         except CloudFlare.exceptions.CloudFlareAPIError as exc:
             LOGGER.error('/accounts/cfd_tunnels/configurations.put %d %s - cloudflare api call failed', exc, exc)
             return False
@@ -9,6 +9,8 @@ LOGGER = logging.getLogger('cf-mgr.dns')
 
 
 class DnsParams(Params):
+    __slots__ = ('_name', '_value', '_dns_type', '_proxied')
+
     def __init__(self, api: Api, account_id: str, name: str, value: str, zone_id: str, dns_type: DnsRecordType,
                  proxied: bool):
         super().__init__(api, account_id, zone_id)
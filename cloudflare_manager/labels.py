@@ -1,5 +1,6 @@
-from collections import OrderedDict
-from urllib.parse import urlparse
+from functools import lru_cache
+import re
+import sys
 from typing import NamedTuple, Optional
 
 from .cloudflare_api import DnsRecordType
@@ -8,8 +9,27 @@ from .params import Params
 from .dns import DnsParams
 from .zerotrust import ZeroTrustParams
 
-TRUES = {'true', 'True', 'TRUE', 't', 'T', '1', True, 1}
-FALSES = {'false', 'False', 'FALSE', 'f', 'F', '0', False, 0, None}
+BOOL_MAP = {'true': True, 't': True, '1': True, 'false': False, 'f': False, '0': False}
+
+# an optional leading wildcard label and an optional trailing dot (fully qualified) are allowed
+HOSTNAME_RE = re.compile(r'\A(?=.{1,253}\.?\Z)(?:\*\.)?(?:[a-z0-9_-]{1,63}\.)+[a-z0-9-]{1,63}\.?\Z', re.IGNORECASE)
+SERVICE_RE = re.compile(r'\A(https?)://([^/\s]+)(/.*)?\Z', re.IGNORECASE)
+
+ZT_HOSTNAME_LABEL = 'cloudflare.zero_trust.access.tunnel.public_hostname'
+ZT_SERVICE_LABEL = 'cloudflare.zero_trust.access.tunnel.service'
+ZT_TUNNEL_ID_LABEL = 'cloudflare.zero_trust.access.tunnel.id'
+ZT_NOTLSVERIFY_LABEL = 'cloudflare.zero_trust.access.tunnel.tls.notlsverify'
+CNAME_NAME_LABEL = 'cloudflare.dns.cname.name'
+CNAME_TARGET_LABEL = 'cloudflare.dns.cname.target'
+A_NAME_LABEL = 'cloudflare.dns.a.name'
+A_IP_LABEL = 'cloudflare.dns.a.ip'
+
+CLOUDFLARE_LABELS = frozenset((ZT_HOSTNAME_LABEL, ZT_SERVICE_LABEL, ZT_TUNNEL_ID_LABEL, ZT_NOTLSVERIFY_LABEL,
+                               CNAME_NAME_LABEL, CNAME_TARGET_LABEL, A_NAME_LABEL, A_IP_LABEL))
+
+
+class LabelError(ValueError):
+    pass
 
 
 class Settings(NamedTuple):
@@ -20,39 +40,45 @@ class Settings(NamedTuple):
     service: Optional[str]
 
 
+@lru_cache(maxsize=4096)
 def validate_hostname(hostname: str):
+    hostname = hostname.strip() if hostname else hostname
     if not hostname:
-        raise Exception('hostname not specified')
-    # TODO: use domain regex
-    hostname_split = hostname.split('.')
-    if len(hostname_split) < 2:
-        raise Exception('hostname must be like "domain.com" or "subdomain.domain.com"')
-    return hostname
+        raise LabelError('hostname not specified')
+    if not HOSTNAME_RE.match(hostname):
+        raise LabelError('hostname must be like "domain.com" or "subdomain.domain.com"')
+    # Cloudflare stores names without the trailing dot
+    return hostname[:-1] if hostname.endswith('.') else hostname
 
 
+@lru_cache(maxsize=256)
 def validate_service(service: str):
     if not service:
-        raise Exception('service not specified')
-    parsed = urlparse(service)
-    if not parsed.scheme or not parsed.netloc:
-        raise Exception('service invalid')
-    if parsed.scheme.lower() not in ('http', 'https'):
-        raise Exception('service invalid scheme')
+        raise LabelError('service not specified')
+    if not SERVICE_RE.match(service):
+        raise LabelError('service invalid')
     return service
 
 
 def validate_notlsverify(val: str) -> Optional[bool]:
     if val is None:
         return None
-    if val in TRUES:
-        return True
-    if val in FALSES:
-        return False
-    raise Exception(f'invalid notlsverify value: "{val}"')
+    if isinstance(val, (bool, int)):
+        return bool(val)
+    result = BOOL_MAP.get(val.lower())
+    if result is None:
+        raise LabelError(f'invalid notlsverify value: "{val}"')
+    return result
 
 
+@lru_cache(maxsize=4096)
 def get_zone_name(hostname: str) -> str:
-    return '.'.join(hostname.split('.')[-2:])
+    return sys.intern(hostname[hostname.rfind('.', 0, hostname.rfind('.')) + 1:])
+
+
+def get_zone_ids(api: Api, zone_names: list[str]) -> list[str]:
+    zone_name_to_id = {zn: api.get_zone_id(zn) for zn in dict.fromkeys(zone_names)}
+    return [zone_name_to_id[zn] for zn in zone_names]
 
 
 def get_val_from_label(labels: dict[str, str], label: str, default: Optional[str] = None) -> Optional[str]:
@@ -62,29 +88,44 @@ def get_val_from_label(labels: dict[str, str], label: str, default: Optional[str
     return default
 
 
-def get_names_from_label(labels: dict[str, str], label: str) -> list[str]:
+@lru_cache(maxsize=1024)
+def split_names(name: str) -> tuple[str, ...]:
+    seen = set()
+    names = []
+    for hn in name.split(','):
+        hn = hn.strip()
+        if hn:
+            hn = validate_hostname(hn)
+            if hn not in seen:
+                seen.add(hn)
+                names.append(hn)
+    return tuple(names)
+
+
+def get_names_from_label(labels: dict[str, str], label: str) -> tuple[str, ...]:
     name = get_val_from_label(labels, label)
     if not name:
-        return []
-    names = OrderedDict.fromkeys(name.strip().split(','))
-    return [validate_hostname(hn) for hn in names.keys()]
+        return ()
+    return split_names(name)
 
 
 def get_zt_params_from_labels(api: Api, settings: Settings, labels: dict[str, str]) -> list[
     ZeroTrustParams]:
-    hostnames = get_names_from_label(labels, 'cloudflare.zero_trust.access.tunnel.public_hostname')
+    hostnames = get_names_from_label(labels, ZT_HOSTNAME_LABEL)
     if not hostnames:
         return []
 
-    service = get_val_from_label(labels, 'cloudflare.zero_trust.access.tunnel.service', settings.service)
+    service = get_val_from_label(labels, ZT_SERVICE_LABEL, settings.service)
     service = validate_service(service)
 
     zone_names = [get_zone_name(hn) for hn in hostnames]
-    zone_ids = [api.get_zone_id(zone_name) for zone_name in zone_names]
+    zone_ids = get_zone_ids(api, zone_names)
 
-    tunnel_id = get_val_from_label(labels, 'cloudflare.zero_trust.access.tunnel.id', settings.tunnel_id)
+    tunnel_id = get_val_from_label(labels, ZT_TUNNEL_ID_LABEL, settings.tunnel_id)
+    if tunnel_id:
+        tunnel_id = sys.intern(tunnel_id)
 
-    notlsverify = get_val_from_label(labels, 'cloudflare.zero_trust.access.tunnel.tls.notlsverify')
+    notlsverify = get_val_from_label(labels, ZT_NOTLSVERIFY_LABEL)
     notlsverify = validate_notlsverify(notlsverify)
 
     if settings.auto_http_host_header:
@@ -101,29 +142,29 @@ def get_zt_params_from_labels(api: Api, settings: Settings, labels: dict[str, st
 
 
 def get_cname_params_from_labels(api: Api, settings: Settings, labels: dict[str, str]) -> list[DnsParams]:
-    cnames = get_names_from_label(labels, 'cloudflare.dns.cname.name')
+    cnames = get_names_from_label(labels, CNAME_NAME_LABEL)
     if not cnames:
         return []
-    target = get_val_from_label(labels, 'cloudflare.dns.cname.target', settings.cname)
+    target = get_val_from_label(labels, CNAME_TARGET_LABEL, settings.cname)
     if not target:
-        raise Exception('target not specified for CNAME')
+        raise LabelError('target not specified for CNAME')
     # TODO: validate target
     zone_names = [get_zone_name(hn) for hn in cnames]
-    zone_ids = [api.get_zone_id(zone_name) for zone_name in zone_names]
+    zone_ids = get_zone_ids(api, zone_names)
     return [DnsParams(api, settings.account_id, name, target, zone_ids[ii], DnsRecordType.CNAME, False) for ii, name in
             enumerate(cnames)]
 
 
 def get_aname_params_from_labels(api: Api, settings: Settings, labels: dict[str, str]) -> list[DnsParams]:
-    anames = get_names_from_label(labels, 'cloudflare.dns.a.name')
+    anames = get_names_from_label(labels, A_NAME_LABEL)
     if not anames:
         return []
-    ip = get_val_from_label(labels, 'cloudflare.dns.a.ip')
+    ip = get_val_from_label(labels, A_IP_LABEL)
     if not ip:
-        raise Exception('ip not specified for A')
+        raise LabelError('ip not specified for A')
     # TODO: validate IP
     zone_names = [get_zone_name(hn) for hn in anames]
-    zone_ids = [api.get_zone_id(zone_name) for zone_name in zone_names]
+    zone_ids = get_zone_ids(api, zone_names)
     return [DnsParams(api, settings.account_id, name, ip, zone_ids[ii], DnsRecordType.A, False) for ii, name in
             enumerate(anames)]
 
@@ -1,27 +1,58 @@
 import argparse
+from concurrent.futures import Executor, ThreadPoolExecutor
 import logging
 import os
-from queue import SimpleQueue
+from queue import Empty, SimpleQueue
 from threading import Thread
+import time
+from typing import Optional
 
 import docker
 from docker.types.daemon import CancellableStream
 
+from .cache import PersistentCache
 from .cloudflare_api import CloudflareApi
 from .api import Api, CachedApi
-from .labels import Settings, get_params_from_labels, TRUES
+from .labels import Settings, LabelError, get_params_from_labels, CLOUDFLARE_LABELS, BOOL_MAP
 from .params import Params
 from .tunnel import Tunnel
 from .zone import Zone
 
 LOGGER = logging.getLogger('cf-mgr.main')
 
+EVENT_BATCH_TIMEOUT = 0.5
+EVENT_BATCH_MAX = 64
+UPDATE_WORKERS = 10
+
 
 def docker_events_thread(events: CancellableStream, queue: SimpleQueue):
     for event in events:
-        status = event.get('status')
-        if event.get('Type') == 'container' and status in ('start', 'die'):
-            queue.put(event)
+        try:
+            if not CLOUDFLARE_LABELS.isdisjoint((event.get('Actor') or {}).get('Attributes') or {}):
+                queue.put(event)
+        except Exception as exc:
+            LOGGER.exception('invalid event: %s', exc)
+
+
+def add_event(events: dict[str, dict], event: dict):
+    # newer daemons no longer send the legacy top-level 'id'
+    container_id = (event.get('Actor') or {}).get('ID')
+    if container_id is None:
+        LOGGER.error('invalid event: %s', event)
+    else:
+        events[container_id] = event
+
+
+def get_event_batch(queue: SimpleQueue, timeout: float, max_batch: int = EVENT_BATCH_MAX) -> list[dict]:
+    events = {}
+    add_event(events, queue.get())
+    deadline = time.monotonic() + timeout
+    try:
+        for _ in range(max_batch - 1):
+            add_event(events, queue.get(timeout=max(0.0, deadline - time.monotonic())))
+    except Empty:
+        pass
+    return list(events.values())
 
 
 def get_env_vars() -> list[str]:
@@ -41,120 +72,177 @@ def get_env_vars() -> list[str]:
 
 
 def get_labels(labels: dict[str, str]):
-    return {key: val for key, val in labels.items() if key.startswith('cloudflare.')}
+    if CLOUDFLARE_LABELS.isdisjoint(labels):
+        return {}
+    return {key: labels[key] for key in labels.keys() & CLOUDFLARE_LABELS}
+
+
+def get_or_create_zone(zones: dict[str, Zone], params: Params) -> Zone:
+    zone = zones.get(params.zone_id)
+    if zone is None:
+        zone = zones[params.zone_id] = Zone(params.api, params.account_id, params.zone_id)
+    return zone
 
 
 def handle_start_event(zones: dict[str, Zone], tunnels: dict[str, Tunnel], params: Params):
-    zone = zones.get(params.zone_id) or Zone(params.api, params.account_id, params.zone_id)
-    zones[params.zone_id] = zone
-    params.add_to_zone(zone)
+    params.add_to_zone(get_or_create_zone(zones, params))
     params.add_to_tunnel(tunnels)
 
 
 def handle_die_event(zones: dict[str, Zone], tunnels: dict[str, Tunnel], params: Params):
-    zone = zones.get(params.zone_id) or Zone(params.api, params.account_id, params.zone_id)
-    zones[params.zone_id] = zone
-    params.remove_from_zone(zone)
+    params.remove_from_zone(get_or_create_zone(zones, params))
     params.remove_from_tunnel(tunnels)
 
 
-def update_cloudflare(args: argparse.Namespace, zones: dict[str, Zone], tunnels: dict[str, Tunnel]):
-    for zone in zones.values():
-        zone.update_cloudflare(args)
+def handle_events(executor: Executor, api: Api, settings: Settings, zones: dict[str, Zone],
+                  tunnels: dict[str, Tunnel], events: list[dict]):
+    labeled = []
+    for event in events:
+        try:
+            attributes = event['Actor']['Attributes']
+            labels = get_labels(attributes)
+            if labels:
+                container_name = attributes['name']
+                LOGGER.info('docker event "%s" for container "%s"', event['status'], container_name)
+                labeled.append((event['status'], container_name, labels))
+        except Exception as exc:
+            LOGGER.exception('invalid event: %s', exc)
 
-    for tunnel in tunnels.values():
-        tunnel.update_cloudflare(args)
+    event_params = []
+    futures = [executor.submit(get_params_from_labels, api, settings, labels) for _, _, labels in labeled]
+    for (status, container_name, _), future in zip(labeled, futures):
+        try:
+            event_params.append((status, container_name, future.result()))
+        except LabelError as exc:
+            LOGGER.error('%s: %s', container_name, exc)
+        except Exception as exc:
+            LOGGER.exception('%s: %s', container_name, exc)
+    create_zones_and_tunnels(executor, zones, tunnels, [pp for _, _, params in event_params for pp in params])
+
+    for status, container_name, params in event_params:
+        handler = handle_start_event if status == 'start' else handle_die_event
+        for pp in params:
+            try:
+                handler(zones, tunnels, pp)
+            except Exception as exc:
+                LOGGER.exception('%s (%s): %s', container_name, pp, exc)
+
+
+def create_zones_and_tunnels(executor: Executor, zones: dict[str, Zone], tunnels: dict[str, Tunnel],
+                             params: list[Params]):
+    new_zones = {pp.zone_id: pp for pp in params if pp.zone_id not in zones}
+    new_tunnels = {pp.tunnel_id: pp for pp in params if pp.tunnel_id and pp.tunnel_id not in tunnels}
+    zone_futures = {zone_id: executor.submit(Zone, pp.api, pp.account_id, zone_id) for zone_id, pp in
+                    new_zones.items()}
+    tunnel_futures = {tunnel_id: executor.submit(Tunnel, pp.api, pp.account_id, tunnel_id) for tunnel_id, pp in
+                      new_tunnels.items()}
+    for zone_id, future in zone_futures.items():
+        try:
+            zones[zone_id] = future.result()
+        except Exception as exc:
+            LOGGER.error('zone "%s": %s', zone_id, exc)
+    for tunnel_id, future in tunnel_futures.items():
+        try:
+            tunnels[tunnel_id] = future.result()
+        except Exception as exc:
+            LOGGER.error('tunnel "%s": %s', tunnel_id, exc)
+
+
+def update_cloudflare(args: argparse.Namespace, zones: dict[str, Zone], tunnels: dict[str, Tunnel],
+                      executor: Optional[Executor] = None):
+    if executor is None or len(zones) + len(tunnels) < 2:
+        for zone in zones.values():
+            zone.update_cloudflare(args, executor)
+        for tunnel in tunnels.values():
+            tunnel.update_cloudflare(args)
+        return
+
+    # The zones fan their record writes out to executor, so they need their own pool to avoid starving it.
+    with ThreadPoolExecutor(max_workers=min(len(zones) + len(tunnels), UPDATE_WORKERS)) as update_executor:
+        futures = [update_executor.submit(zone.update_cloudflare, args, executor) for zone in zones.values()]
+        futures += [update_executor.submit(tunnel.update_cloudflare, args) for tunnel in tunnels.values()]
+    for future in futures:
+        future.result()
 
 
 def load_containers(args: argparse.Namespace, containers: list, api: Api, settings: Settings):
     zones: dict[str, Zone] = {}
     tunnels: dict[str, Tunnel] = {}
+    labeled = []
+    debug = LOGGER.isEnabledFor(logging.DEBUG)
     for container in containers:
-        LOGGER.debug('inspecting container "%s"', container.name)
+        if debug:
+            LOGGER.debug('inspecting container "%s"', container.name)
         if container.status != 'running':
             continue
         labels = get_labels(container.labels)
-        if not labels:
-            continue
-        try:
-            params = get_params_from_labels(api, settings, labels)
+        if labels:
+            labeled.append((container, labels))
+
+    container_params = []
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(get_params_from_labels, api, settings, labels) for _, labels in labeled]
+        for (container, _), future in zip(labeled, futures):
+            try:
+                container_params.append((container, future.result()))
+            except Exception as exc:
+                LOGGER.error('%s: %s', container.name, exc)
+        create_zones_and_tunnels(executor, zones, tunnels, [pp for _, params in container_params for pp in params])
+
+        for container, params in container_params:
             for pp in params:
                 try:
                     handle_start_event(zones, tunnels, pp)
                 except Exception as exc:
                     LOGGER.exception('%s (%s): %s', container.name, pp, exc)
-        except Exception as exc:
-            LOGGER.error('%s: %s', container.name, exc)
 
-    update_cloudflare(args, zones, tunnels)
+        update_cloudflare(args, zones, tunnels, executor)
 
 
 def main(args: argparse.Namespace):
     docker_events = None
+    store = None
 
     try:
         cf_account_id, cf_token, cf_tunnel_id = get_env_vars()
+        auto_http_host_header = BOOL_MAP.get(os.environ.get('CLOUDFLARE_AUTO_HTTP_HOST_HEADER', '').lower(), False)
         settings = Settings(
-            cf_account_id, cf_tunnel_id, os.environ.get('CLOUDFLARE_AUTO_HTTP_HOST_HEADER') in TRUES,
+            cf_account_id, cf_tunnel_id, auto_http_host_header,
             os.environ.get('CLOUDFLARE_DEFAULT_CNAME'),
             os.environ.get('CLOUDFLARE_DEFAULT_SERVICE'))
 
-        cf = CloudflareApi(cf_token, debug=pargs.debug)
+        cf = CloudflareApi(cf_token, debug=args.debug, pool_size=args.workers)
+        if args.cache_file:
+            store = PersistentCache(args.cache_file, args.cache_ttl)
         docker_client = docker.from_env()
 
         queue = SimpleQueue()
-        docker_events = docker_client.events(decode=True)
-        thread = Thread(target=docker_events_thread, args=(docker_events, queue), name='docker_events')
+        docker_events = docker_client.events(decode=True, filters={'type': 'container', 'event': ['start', 'die']})
+        thread = Thread(target=docker_events_thread, args=(docker_events, queue), name='docker_events', daemon=True)
         thread.start()
 
         LOGGER.info('Using tunnel ID "%s" as default tunnel', cf_tunnel_id)
 
+        api = CachedApi(cf, store=store, ttl=args.cache_ttl)
         try:
-            api = CachedApi(cf)
-            load_containers(args, docker_client.containers.list(all=True), api, settings)
+            load_containers(args, docker_client.containers.list(filters={'status': 'running'}), api, settings)
         except Exception as exc:
             LOGGER.critical('%s', exc)
             raise SystemExit(1)
 
-        while True:
-            event = queue.get()
-            api = CachedApi(cf)
-            zones: dict[str, Zone] = {}
-            tunnels: dict[str, Tunnel] = {}
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            while True:
+                events = get_event_batch(queue, EVENT_BATCH_TIMEOUT)
+                api.expire()
+                zones: dict[str, Zone] = {}
+                tunnels: dict[str, Tunnel] = {}
 
-            try:
-                status = event['status']
-                attributes = event['Actor']['Attributes']
-                labels = get_labels(attributes)
-                if not labels:
-                    continue
-
-                container_name = attributes["name"]
-                LOGGER.info('docker event "%s" for container "%s"', status, container_name)
+                handle_events(executor, api, settings, zones, tunnels, events)
 
                 try:
-                    params = get_params_from_labels(api, settings, labels)
+                    update_cloudflare(args, zones, tunnels, executor)
                 except Exception as exc:
-                    LOGGER.exception('%s: %s', container_name, exc)
-                    continue
-
-                if status == 'start':
-                    for pp in params:
-                        try:
-                            handle_start_event(zones, tunnels, pp)
-                        except Exception as exc:
-                            LOGGER.exception('%s (%s): %s', container_name, pp, exc)
-                elif status == 'die':
-                    for pp in params:
-                        try:
-                            handle_die_event(zones, tunnels, pp)
-                        except Exception as exc:
-                            LOGGER.exception('%s (%s): %s', container_name, pp, exc)
-
-                update_cloudflare(args, zones, tunnels)
-
-            except Exception as exc:
-                LOGGER.exception('invalid event: %s', exc)
+                    LOGGER.exception('update failed: %s', exc)
     except KeyboardInterrupt:
         pass
     except Exception as exc:
@@ -162,6 +250,8 @@ def main(args: argparse.Namespace):
     finally:
         if docker_events:
             docker_events.close()
+        if store:
+            store.close()
 
 
 if __name__ == '__main__':
@@ -171,6 +261,13 @@ if __name__ == '__main__':
                         default='info', help='set the log level [info]')
     parser.add_argument('-d', '--dry-run', action='store_true',
                         help="don't run Cloudflare APIs that modify")
+    parser.add_argument('-w', '--workers', type=int, default=8,
+                        help='number of concurrent Cloudflare API lookups [8]')
+    parser.add_argument('--cache-file', default=os.environ.get('CLOUDFLARE_CACHE_FILE'),
+                        help='persist Cloudflare lookups in this SQLite file across restarts '
+                             '[$CLOUDFLARE_CACHE_FILE]')
+    parser.add_argument('--cache-ttl', type=int, default=900,
+                        help='seconds to keep cached Cloudflare lookups [900]')
     parser.add_argument('--debug', action='store_true',
                         help='turn on Cloudflare API debug')
     pargs = parser.parse_args()
@@ -1,7 +1,10 @@
+from typing import Optional
 from .api import Api
 
 
 class Params:
+    __slots__ = ('_api', '_account_id', '_zone_id')
+
     def __init__(self, api: Api, account_id: str, zone_id: str):
         self._api = api
         self._account_id = account_id
@@ -19,6 +22,10 @@ class Params:
     def zone_id(self):
         return self._zone_id
 
+    @property
+    def tunnel_id(self) -> Optional[str]:
+        return None
+
     def add_to_zone(self, zone):
         raise NotImplementedError()
 
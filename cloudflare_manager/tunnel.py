@@ -5,13 +5,8 @@ from .api import Api
 
 LOGGER = logging.getLogger('cf-mgr.tunnel')
 
-
-def ingress_exists(params, tunnel_ingress: list) -> bool:
-    hostname_lower = params.hostname.lower()
-    for item in tunnel_ingress:
-        if item.get('hostname', '').lower() == hostname_lower:
-            return True
-    return False
+# shared by every ingress rule without origin settings; treat as read-only
+EMPTY_ORIGIN_REQUEST = {}
 
 
 def params_to_tunnel_ingress_entry(params) -> dict[str, str]:
@@ -25,7 +20,7 @@ def params_to_tunnel_ingress_entry(params) -> dict[str, str]:
     return {
         'service': params.service,
         'hostname': params.hostname,
-        'originRequest': origin_request,
+        'originRequest': origin_request or EMPTY_ORIGIN_REQUEST,
     }
 
 
@@ -34,34 +29,50 @@ class Tunnel:
         self._api = api
         self._account_id = account_id
         self._tunnel_id = tunnel_id
-        self._ingress = api.get_tunnel_ingress(account_id, tunnel_id)
+        # the ordered rule list is what gets PUT back; the hostname set only speeds up the membership checks
+        ingress = api.get_tunnel_ingress(account_id, tunnel_id)
+        self._ingress = ingress[:-1]
+        self._catch_all = ingress[-1]
+        self._ingress_hostnames = [ii.get('hostname', '').lower() for ii in self._ingress]
+        self._hostnames = {hn for hn in self._ingress_hostnames if hn}
         self._ingress_changed = False
 
     def add_ingress(self, params):
-        if ingress_exists(params, self._ingress):
+        hostname_lower = params.hostname.lower()
+        if hostname_lower in self._hostnames:
             LOGGER.info('Public hostname "%s" for tunnel "%s" already exists', params.hostname, params.tunnel_id)
         else:
-            self._ingress.insert(-1, params_to_tunnel_ingress_entry(params))
-            LOGGER.info(f'Adding public hostname "%s" -> "%s" for tunnel "%s"', params.hostname, params.service,
+            self._ingress.append(params_to_tunnel_ingress_entry(params))
+            self._ingress_hostnames.append(hostname_lower)
+            self._hostnames.add(hostname_lower)
+            LOGGER.info('Adding public hostname "%s" -> "%s" for tunnel "%s"', params.hostname, params.service,
                         params.tunnel_id)
             self._ingress_changed = True
 
     def remove_ingress(self, params):
-        LOGGER.info(f'Removing public hostname "%s" for tunnel "%s"', params.hostname, params.tunnel_id)
-        before_len = len(self._ingress)
+        LOGGER.info('Removing public hostname "%s" for tunnel "%s"', params.hostname, params.tunnel_id)
         hostname_lower = params.hostname.lower()
-        self._ingress = [ii for ii in self._ingress if ii.get('hostname', '').lower() != hostname_lower]
-        if before_len == len(self._ingress):
+        if hostname_lower not in self._hostnames:
             LOGGER.warning('No public hostname "%s" for tunnel "%s"', params.hostname, params.tunnel_id)
         else:
+            idx = self._ingress_hostnames.index(hostname_lower)
+            while True:
+                del self._ingress[idx]
+                del self._ingress_hostnames[idx]
+                try:
+                    idx = self._ingress_hostnames.index(hostname_lower, idx)
+                except ValueError:
+                    break
+            self._hostnames.discard(hostname_lower)
             self._ingress_changed = True
 
     def update_cloudflare(self, args: argparse.Namespace):
         if self._ingress_changed:
+            ingress = self._ingress + [self._catch_all]
             if LOGGER.isEnabledFor(logging.INFO):
-                LOGGER.info('Updating ingress for tunnel %s:\n%s', self._tunnel_id, pformat(self._ingress))
+                LOGGER.info('Updating ingress for tunnel %s:\n%s', self._tunnel_id, pformat(ingress))
             if not args.dry_run:
                 if not self._api.cf.update_tunnel_configs(self._account_id, self._tunnel_id,
-                                                          {'config': {'ingress': self._ingress}}):
-                    LOGGER.error(f'Failed to update tunnel ingress for tunnel "{self._tunnel_id}" failed')
+                                                          {'config': {'ingress': ingress}}):
+                    LOGGER.error('Failed to update tunnel ingress for tunnel "%s" failed', self._tunnel_id)
             self._ingress_changed = False
@@ -1,3 +1,4 @@
+from functools import lru_cache
 import logging
 from typing import Optional
 from .cloudflare_api import DnsRecordType
@@ -9,7 +10,15 @@ from .tunnel import Tunnel
 LOGGER = logging.getLogger('cf-mgr.zerotrust')
 
 
+@lru_cache(maxsize=64)
+def get_cname_target(tunnel_id: str) -> str:
+    return f'{tunnel_id}.cfargotunnel.com'
+
+
 class ZeroTrustParams(Params):
+    __slots__ = ('_hostname', '_service', '_zone_name', '_tunnel_id', '_notlsverify', '_host_header',
+                 '_origin_server_name', '_dns_params')
+
     def __init__(self, api: Api, account_id: str, hostname: str, service: str, zone_name: str, zone_id: str,
                  tunnel_id: str,
                  notlsverify: Optional[bool] = None,
@@ -23,7 +32,7 @@ class ZeroTrustParams(Params):
         self._notlsverify = notlsverify
         self._host_header = host_header
         self._origin_server_name = origin_server_name
-        self._dns_params = DnsParams(api, account_id, hostname, f'{tunnel_id}.cfargotunnel.com', zone_id,
+        self._dns_params = DnsParams(api, account_id, hostname, get_cname_target(tunnel_id), zone_id,
                                      DnsRecordType.CNAME, True)
 
     def __str__(self):
@@ -45,6 +54,10 @@ class ZeroTrustParams(Params):
     def tunnel_id(self):
         return self._tunnel_id
 
+    @property
+    def cname_target(self):
+        return self._dns_params.value
+
     @property
     def notlsverify(self):
         return self._notlsverify
@@ -68,8 +81,9 @@ class ZeroTrustParams(Params):
         zone.remove_dns_record(self._dns_params)
 
     def _get_tunnel(self, tunnels: dict[str, Tunnel]):
-        tunnel = tunnels.get(self._tunnel_id) or Tunnel(self._api, self._account_id, self._tunnel_id)
-        tunnels[self._tunnel_id] = tunnel
+        tunnel = tunnels.get(self._tunnel_id)
+        if tunnel is None:
+            tunnel = tunnels[self._tunnel_id] = Tunnel(self._api, self._account_id, self._tunnel_id)
         return tunnel
 
     def add_to_tunnel(self, tunnels: dict[str, Tunnel]):
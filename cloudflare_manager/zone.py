@@ -1,6 +1,7 @@
 import argparse
-from collections import OrderedDict
+from concurrent.futures import Executor
 import logging
+from typing import Optional
 from .api import Api
 from .dns import DnsParams
 
@@ -12,12 +13,18 @@ class Zone:
         self._api = api
         self._account_id = account_id
         self._zone_id = zone_id
-        self._records = api.get_dns_records(zone_id)
-        self._new_records: OrderedDict[DnsParams] = OrderedDict()
-        self._dns_removals: OrderedDict[str] = OrderedDict()
+        # Cloudflare stores record names in lowercase; map them to their ids, which may be unknown
+        self._name_to_id: dict[str, Optional[str]] = {name.lower(): rec.get('id') for name, rec in
+                                                      api.get_dns_records(zone_id).items()}
+        self._new_records: dict[DnsParams, None] = {}
+        self._dns_removals: dict[str, str] = {}
 
     def add_dns_record(self, params: DnsParams):
-        if params.name in self._records:
+        name_lower = params.name.lower()
+        if name_lower in self._dns_removals:
+            LOGGER.info('Keeping %s DNS record "%s"', params.dns_type.name, params.name)
+            del self._dns_removals[name_lower]
+        elif name_lower in self._name_to_id:
             LOGGER.info('DNS record for "%s" already exists', params.name)
         elif params in self._new_records:
             LOGGER.error('duplicate DNS record for "%s" "%s"', params.name, params.zone_id)
@@ -25,24 +32,40 @@ class Zone:
             self._new_records[params] = None
 
     def remove_dns_record(self, params: DnsParams):
-        LOGGER.info(f'Removing %s DNS record "%s"', params.dns_type.name, params.name)
-        record_id = self._api.get_dns_record_id(params.zone_id, params.name)
+        if params in self._new_records:
+            del self._new_records[params]
+            return
+        LOGGER.info('Removing %s DNS record "%s"', params.dns_type.name, params.name)
+        record_id = (self._name_to_id.get(params.name.lower()) or
+                     self._api.get_dns_record_id(params.zone_id, params.name))
         if record_id:
-            self._dns_removals[record_id] = None
+            self._dns_removals[params.name.lower()] = record_id
         else:
             LOGGER.warning('No %s DNS record "%s"', params.dns_type.name, params.name)
 
-    def update_cloudflare(self, args: argparse.Namespace):
-        for record_id in self._dns_removals.keys():
-            if not args.dry_run:
-                if not self._api.cf.delete_dns_record(self._zone_id, record_id):
-                    LOGGER.error('Failed to remove DNS record ID %s', record_id)
+    def update_cloudflare(self, args: argparse.Namespace, executor: Optional[Executor] = None):
+        if not args.dry_run and (self._dns_removals or self._new_records):
+            self._api.invalidate_dns_records(self._zone_id)
+        map_func = executor.map if executor else map
+
+        record_ids = list(self._dns_removals.values())
         self._dns_removals.clear()
+        if record_ids and not args.dry_run:
+            if len(record_ids) > 1:
+                ok = self._api.cf.delete_dns_records(self._zone_id, record_ids)
+            else:
+                ok = self._api.cf.delete_dns_record(self._zone_id, record_ids[0])
+            if not ok:
+                LOGGER.error('Failed to remove DNS record IDs %s', ', '.join(record_ids))
 
-        for params in self._new_records.keys():
+        new_records = list(self._new_records.keys())
+        self._new_records.clear()
+        for params in new_records:
             LOGGER.info('Adding %s DNS record "%s" -> "%s"', params.dns_type.name, params.name, params.value)
-            if not args.dry_run:
-                if not self._api.cf.create_dns_record(params.dns_type, params.zone_id, params.name,
-                                                      params.value, params.proxied):
+        if not args.dry_run:
+            results = map_func(lambda params: self._api.cf.create_dns_record(params.dns_type, params.zone_id,
+                                                                             params.name, params.value,
+                                                                             params.proxied), new_records)
+            for params, ok in zip(new_records, results):
+                if not ok:
                     LOGGER.error('Failed to add %s DNS record "%s"', params.dns_type.name, params.name)
-        self._new_records.clear()
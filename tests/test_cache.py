@@ -0,0 +1,159 @@
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+import unittest
+from unittest.mock import create_autospec
+
+from cloudflare_manager.api import CachedApi
+from cloudflare_manager.cache import MISSING, PersistentCache
+from cloudflare_manager.cloudflare_api import CloudflareApi, DnsRecordType
+from cloudflare_manager.dns import DnsParams
+from cloudflare_manager.zone import Zone
+
+args = SimpleNamespace(dry_run=False)
+
+cf_mock = create_autospec(CloudflareApi, instance=True, spec_set=True)
+
+
+class TestPersistentCache(unittest.TestCase):
+    def setUp(self):
+        cf_mock.reset_mock(return_value=True, side_effect=True)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'cache.db')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_get_set_delete(self):
+        store = PersistentCache(self.path, 60)
+        self.assertIs(store.get('get_zone', ('example.com',)), MISSING)
+        store.set('get_zone', ('example.com',), {'id': 'example_zone_id'})
+        self.assertEqual(store.get('get_zone', ('example.com',)), {'id': 'example_zone_id'})
+        store.delete('get_zone', ('example.com',))
+        self.assertIs(store.get('get_zone', ('example.com',)), MISSING)
+        store.close()
+
+    def test_expired(self):
+        store = PersistentCache(self.path, 0)
+        store.set('get_zone', ('example.com',), {'id': 'example_zone_id'})
+        time.sleep(0.01)
+        self.assertIs(store.get('get_zone', ('example.com',)), MISSING)
+        store.close()
+
+    def test_survives_restart(self):
+        cf_mock.get_zones.return_value = None
+        cf_mock.get_zone.return_value = {'id': 'example_zone_id'}
+
+        store = PersistentCache(self.path, 60)
+        self.assertEqual(CachedApi(cf_mock, store=store).get_zone_id('example.com'), 'example_zone_id')
+        store.close()
+
+        store = PersistentCache(self.path, 60)
+        self.assertEqual(CachedApi(cf_mock, store=store).get_zone_id('example.com'), 'example_zone_id')
+        store.close()
+
+        cf_mock.get_zone.assert_called_once_with('example.com')
+
+    def test_invalidated_after_write(self):
+        cf_mock.get_dns_records.return_value = []
+
+        store = PersistentCache(self.path, 60)
+        api = CachedApi(cf_mock, store=store)
+        zone = Zone(api, 'account_id', 'example_zone_id')
+        zone.add_dns_record(DnsParams(api, 'account_id', 'a.example.com', '127.0.0.1', 'example_zone_id',
+                                      DnsRecordType.A, False))
+        zone.update_cloudflare(args)
+
+        self.assertIs(store.get('get_dns_records', ('example_zone_id',)), MISSING)
+        CachedApi(cf_mock, store=store).get_dns_records('example_zone_id')
+        self.assertEqual(cf_mock.get_dns_records.call_count, 2)
+        store.close()
+
+    def test_record_ids_not_persisted(self):
+        cf_mock.get_dns_record_id.return_value = 'dns_record_id'
+
+        store = PersistentCache(self.path, 60)
+        api = CachedApi(cf_mock, store=store)
+        api.get_dns_record_id('example_zone_id', 'a.example.com')
+        self.assertIs(store.get('get_dns_record_id', ('example_zone_id', 'a.example.com')), MISSING)
+        store.close()
+
+    def test_record_ids_not_persisted_with_records(self):
+        cf_mock.get_dns_records.return_value = [{'name': 'a.example.com', 'type': 'A', 'id': 'stale_record_id'}]
+        cf_mock.get_dns_record_id.return_value = 'dns_record_id'
+        cf_mock.delete_dns_record.return_value = True
+
+        store = PersistentCache(self.path, 60)
+        CachedApi(cf_mock, store=store).get_dns_records('example_zone_id')
+        self.assertEqual(store.get('get_dns_records', ('example_zone_id',)),
+                         {'a.example.com': {'name': 'a.example.com', 'type': 'A'}})
+
+        api = CachedApi(cf_mock, store=store)
+        zone = Zone(api, 'account_id', 'example_zone_id')
+        zone.remove_dns_record(DnsParams(api, 'account_id', 'a.example.com', '127.0.0.1', 'example_zone_id',
+                                         DnsRecordType.A, False))
+        zone.update_cloudflare(args)
+        store.close()
+
+        cf_mock.get_dns_records.assert_called_once_with('example_zone_id')
+        cf_mock.get_dns_record_id.assert_called_once_with('example_zone_id', 'a.example.com')
+        cf_mock.delete_dns_record.assert_called_once_with('example_zone_id', 'dns_record_id')
+
+
+class TestCachedApiTtl(unittest.TestCase):
+    def setUp(self):
+        cf_mock.reset_mock(return_value=True, side_effect=True)
+
+    def test_expire(self):
+        cf_mock.get_dns_records.return_value = []
+
+        api = CachedApi(cf_mock, ttl=60)
+        api.get_dns_records('example_zone_id')
+        api.expire()
+        api.get_dns_records('example_zone_id')
+        cf_mock.get_dns_records.assert_called_once_with('example_zone_id')
+
+        api = CachedApi(cf_mock, ttl=0)
+        api.get_dns_records('example_zone_id')
+        api.expire()
+        api.get_dns_records('example_zone_id')
+        self.assertEqual(cf_mock.get_dns_records.call_count, 3)
+
+    def test_dns_records_keyed_by_zone_id(self):
+        cf_mock.get_dns_records.return_value = [{'name': 'a.example.com', 'id': 'dns_record_id'}]
+
+        api = CachedApi(cf_mock, ttl=60)
+        api.get_dns_records('example_zone_id')
+        self.assertEqual(list(api._dns_records_by_zone_id), ['example_zone_id'])
+        self.assertEqual(api.get_dns_record_id('example_zone_id', 'a.example.com'), 'dns_record_id')
+
+        api.invalidate_dns_records('example_zone_id')
+        self.assertEqual(api._dns_records_by_zone_id, {})
+
+    def test_listed_zones_expire_and_persist(self):
+        cf_mock.get_zones.return_value = [{'id': 'example_zone_id', 'name': 'example.com'}]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = PersistentCache(os.path.join(tmpdir, 'cache.db'), 60)
+            api = CachedApi(cf_mock, store=store, ttl=0)
+            api.get_zone_id('example.com')
+            self.assertEqual(store.get('get_zone', ('example.com',)), {'id': 'example_zone_id', 'name': 'example.com'})
+            api.expire()
+            api.get_zone_id('example.com')
+            store.close()
+        self.assertEqual(cf_mock.get_zones.call_count, 2)
+        cf_mock.get_zone.assert_not_called()
+
+    def test_clear(self):
+        cf_mock.get_zones.return_value = [{'id': 'example_zone_id', 'name': 'example.com'}]
+        cf_mock.get_dns_records.return_value = []
+
+        api = CachedApi(cf_mock)
+        api.get_zone_id('example.com')
+        api.get_dns_records('example_zone_id')
+        api.clear()
+        api.get_zone_id('example.com')
+        api.get_dns_records('example_zone_id')
+        self.assertEqual(cf_mock.get_zones.call_count, 2)
+        self.assertEqual(cf_mock.get_dns_records.call_count, 2)
@@ -0,0 +1,141 @@
+import unittest
+from unittest.mock import call, patch
+
+from CloudFlare.exceptions import CloudFlareAPIError
+from requests import HTTPError, Response
+
+from cloudflare_manager.cloudflare_api import CloudflareApi, DNS_BATCH_MAX, DNS_RECORDS_PER_PAGE, DnsRecordType, \
+    TokenBucket, ZONES_PER_PAGE
+
+
+def make_response(status_code: int, retry_after: str = None) -> Response:
+    response = Response()
+    response.status_code = status_code
+    if retry_after is not None:
+        response.headers['Retry-After'] = retry_after
+    return response
+
+
+class TestCloudflareApi(unittest.TestCase):
+    def setUp(self):
+        with patch('cloudflare_manager.cloudflare_api.CloudFlare.CloudFlare') as cf_class:
+            self.api = CloudflareApi('token', retry_count=2, retry_base_delay=0)
+        self.cf = cf_class.return_value
+
+    @patch('cloudflare_manager.cloudflare_api.time.sleep')
+    def test_retry_rate_limited(self, sleep_mock):
+        self.cf.zones.get.side_effect = [CloudFlareAPIError(971, 'rate limited'), [{'id': 'zone_id'}]]
+        self.assertEqual(self.api.get_zone('example.com'), {'id': 'zone_id'})
+        self.assertEqual(self.cf.zones.get.call_count, 2)
+        sleep_mock.assert_called_once()
+
+    @patch('cloudflare_manager.cloudflare_api.time.sleep')
+    def test_retry_gives_up(self, sleep_mock):
+        self.cf.zones.get.side_effect = CloudFlareAPIError(971, 'rate limited')
+        self.assertIsNone(self.api.get_zone('example.com'))
+        self.assertEqual(self.cf.zones.get.call_count, 3)
+        self.assertEqual(sleep_mock.call_count, 2)
+
+    @patch('cloudflare_manager.cloudflare_api.time.sleep')
+    def test_retry_after_too_many_requests(self, sleep_mock):
+        hook = self.cf._base.network.session.hooks['response'][0]
+
+        def get(params):
+            if self.cf.zones.get.call_count > 1:
+                return [{'id': 'zone_id'}]
+            hook(make_response(429, '7'))
+            raise CloudFlareAPIError(429, 'HTTP response code 429')
+
+        self.cf.zones.get.side_effect = get
+        self.assertEqual(self.api.get_zone('example.com'), {'id': 'zone_id'})
+        self.assertEqual(self.cf.zones.get.call_count, 2)
+        self.assertGreaterEqual(sleep_mock.call_args.args[0], 7)
+
+    @patch('cloudflare_manager.cloudflare_api.time.sleep')
+    def test_retry_after_server_error(self, sleep_mock):
+        self.cf.zones.get.side_effect = [HTTPError(response=make_response(503, '5')), [{'id': 'zone_id'}]]
+        self.assertEqual(self.api.get_zone('example.com'), {'id': 'zone_id'})
+        self.assertGreaterEqual(sleep_mock.call_args.args[0], 5)
+
+    @patch('cloudflare_manager.cloudflare_api.time.sleep')
+    def test_no_retry_create_server_error(self, sleep_mock):
+        self.cf.zones.dns_records.post.side_effect = HTTPError(response=make_response(502))
+        self.assertFalse(self.api.create_dns_record(DnsRecordType.A, 'zone_id', 'host.example.com', '1.2.3.4', True))
+        self.assertEqual(self.cf.zones.dns_records.post.call_count, 1)
+        sleep_mock.assert_not_called()
+
+    @patch('cloudflare_manager.cloudflare_api.time.sleep')
+    def test_no_retry_other_errors(self, sleep_mock):
+        self.cf.zones.get.side_effect = CloudFlareAPIError(1003, 'invalid zone')
+        self.assertIsNone(self.api.get_zone('example.com'))
+        self.assertEqual(self.cf.zones.get.call_count, 1)
+        sleep_mock.assert_not_called()
+
+    def test_get_dns_records_filters_types(self):
+        self.cf.zones.dns_records.get.return_value = [
+            {'type': 'A', 'name': 'a.example.com'},
+            {'type': 'CNAME', 'name': 'cname.example.com'},
+            {'type': 'TXT', 'name': 'txt.example.com'},
+        ]
+        result = self.api.get_dns_records('zone_id')
+        self.assertCountEqual([rr['name'] for rr in result], ['a.example.com', 'cname.example.com'])
+        self.cf.zones.dns_records.get.assert_called_once_with('zone_id', params={
+            'per_page': DNS_RECORDS_PER_PAGE, 'page': 1})
+
+    def test_get_dns_records_pages(self):
+        self.cf.zones.dns_records.get.side_effect = [
+            [{'type': 'A', 'name': f'{ii}.example.com'} for ii in range(DNS_RECORDS_PER_PAGE)],
+            [{'type': 'A', 'name': 'last.example.com'}],
+        ]
+        result = self.api.get_dns_records('zone_id')
+        self.assertEqual(len(result), DNS_RECORDS_PER_PAGE + 1)
+        self.assertEqual(self.cf.zones.dns_records.get.call_count, 2)
+
+    def test_get_zones_pages(self):
+        self.cf.zones.get.side_effect = [
+            [{'id': f'zone_id{ii}', 'name': f'example{ii}.com'} for ii in range(ZONES_PER_PAGE)],
+            [{'id': 'last_zone_id', 'name': 'last.com'}],
+        ]
+        result = self.api.get_zones()
+        self.assertEqual(len(result), ZONES_PER_PAGE + 1)
+        self.assertEqual(self.cf.zones.get.call_count, 2)
+
+    def test_get_zones_single_page(self):
+        self.cf.zones.get.return_value = [{'id': 'zone_id', 'name': 'example.com'}]
+        self.assertEqual(self.api.get_zones(), [{'id': 'zone_id', 'name': 'example.com'}])
+        self.cf.zones.get.assert_called_once_with(params={'per_page': ZONES_PER_PAGE, 'page': 1})
+
+    def test_delete_dns_records_batches(self):
+        record_ids = [f'dns_record_id{ii}' for ii in range(DNS_BATCH_MAX + 1)]
+        self.assertTrue(self.api.delete_dns_records('zone_id', record_ids))
+        self.cf.zones.dns_records.batch.post.assert_has_calls([
+            call('zone_id', data={'deletes': [{'id': record_id} for record_id in record_ids[:DNS_BATCH_MAX]]}),
+            call('zone_id', data={'deletes': [{'id': record_ids[-1]}]}),
+        ])
+
+
+class TestCloudflareApiSdk(unittest.TestCase):
+    def test_construct_with_sdk(self):
+        api = CloudflareApi('token')
+        self.assertIn(api._remember_response, api._cf._base.network.session.hooks['response'])
+
+    def test_construct_without_network(self):
+        with patch('cloudflare_manager.cloudflare_api.CloudFlare.CloudFlare') as cf_class:
+            del cf_class.return_value._base
+            api = CloudflareApi('token')
+        self.assertEqual(api.get_zone('example.com'), cf_class.return_value.zones.get.return_value[0])
+
+
+class TestTokenBucket(unittest.TestCase):
+    @patch('cloudflare_manager.cloudflare_api.time.sleep')
+    @patch('cloudflare_manager.cloudflare_api.time.monotonic', return_value=100.0)
+    def test_acquire(self, monotonic_mock, sleep_mock):
+        bucket = TokenBucket(2, 1.0)
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.acquire(), 1.0)
+        self.assertEqual(bucket.acquire(), 2.0)
+        sleep_mock.assert_has_calls([call(1.0), call(2.0)])
+
+        monotonic_mock.return_value = 105.0
+        self.assertEqual(bucket.acquire(), 0)
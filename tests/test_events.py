@@ -1,56 +1,88 @@
-import argparse
-from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import logging
+from queue import SimpleQueue
+from types import SimpleNamespace
 import unittest
-from unittest.mock import Mock, call
+from unittest.mock import call, create_autospec
 
 from cloudflare_manager.cloudflare_api import CloudflareApi, DnsRecordType
 from cloudflare_manager.api import CachedApi
-from cloudflare_manager.main import handle_start_event, handle_die_event, update_cloudflare
+from cloudflare_manager.labels import Settings, A_IP_LABEL, A_NAME_LABEL, ZT_HOSTNAME_LABEL, ZT_SERVICE_LABEL
+from cloudflare_manager.main import docker_events_thread, get_event_batch, handle_events, handle_start_event, \
+    handle_die_event, update_cloudflare
 from cloudflare_manager.zerotrust import ZeroTrustParams
 
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s|%(name)s|%(levelname)s|%(message)s')
+args = SimpleNamespace(dry_run=False)
 
-args = argparse.Namespace(dry_run=False)
+cf_mock = create_autospec(CloudflareApi, instance=True, spec_set=True)
+
+HOST = 'host.example.com'
+SERVICE = 'http://service:80'
+ACCOUNT_ID = 'account_id'
+TUNNEL_ID = 'tunnel_id'
+ZONE = 'example.com'
+ZONE_ID = 'example_zone_id'
+
+CATCH_ALL = {'service': 'http_status:404'}
+INGRESS = (
+    {'service': SERVICE, 'hostname': HOST, 'originRequest': {}},
+    CATCH_ALL,
+)
+EXPECTED_EMPTY_VALUE = {'config': {'ingress': [CATCH_ALL]}}
+
+
+def make_params(api, hostname=HOST, zone=ZONE, zone_id=ZONE_ID):
+    return ZeroTrustParams(api, ACCOUNT_ID, hostname, SERVICE, zone, zone_id, TUNNEL_ID, None)
 
 
 class TestEvents(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.getLogger().setLevel(logging.CRITICAL)
+        cls.api = CachedApi(cf_mock)
+
+    def setUp(self):
+        cf_mock.reset_mock(return_value=True, side_effect=True)
+        self.api.clear()
+        cf_mock.create_dns_record.return_value = True
+        cf_mock.delete_dns_record.return_value = True
+        cf_mock.delete_dns_records.return_value = True
+        cf_mock.update_tunnel_configs.return_value = True
+
     def test_start(self):
-        cf_mock = Mock(CloudflareApi)
-        cf_mock.get_zone_id.return_value = 'example_zone_id'
+        cf_mock.get_zone.return_value = {'id': ZONE_ID}
         cf_mock.get_dns_records.return_value = []
-        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': 'tunnel_id', 'config': None}
+        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': TUNNEL_ID, 'config': None}
 
-        params = ZeroTrustParams(CachedApi(cf_mock), 'account_id', 'host.example.com', 'http://service:80',
-                                 'example.com', 'example_zone_id', 'tunnel_id',
-                                 None)
+        params = make_params(self.api)
         zones = {}
         tunnels = {}
         handle_start_event(zones, tunnels, params)
         update_cloudflare(args, zones, tunnels)
 
-        cf_mock.create_dns_record.assert_called_once_with(DnsRecordType.CNAME, 'example_zone_id', 'host.example.com',
+        cf_mock.create_dns_record.assert_called_once_with(DnsRecordType.CNAME, ZONE_ID, HOST,
                                                           'tunnel_id.cfargotunnel.com', True)
-        value = {
-            'config': {
-                'ingress': [
-                    {'service': 'http://service:80', 'hostname': 'host.example.com', 'originRequest': {}},
-                    {'service': 'http_status:404'},
-                ]
-            }
-        }
-        cf_mock.update_tunnel_configs.assert_called_once_with('account_id', 'tunnel_id', value)
+        self.assertEqual(cf_mock.update_tunnel_configs.call_count, 1)
+        self.assertEqual(cf_mock.update_tunnel_configs.call_args.args[2]['config']['ingress'], list(INGRESS))
 
     def test_start_cname_already_exists(self):
-        cf_mock = Mock(CloudflareApi)
-        cf_mock.get_zone_id.return_value = 'example_zone_id'
+        cf_mock.get_zone.return_value = {'id': ZONE_ID}
+        cf_mock.get_dns_records.return_value = [{'name': HOST}]
+        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': TUNNEL_ID, 'config': None}
+
+        params = make_params(self.api)
+        zones = {}
+        tunnels = {}
+        handle_start_event(zones, tunnels, params)
+        update_cloudflare(args, zones, tunnels)
+
+        cf_mock.create_dns_record.assert_not_called()
+
+    def test_start_cname_exists_different_case(self):
         cf_mock.get_dns_records.return_value = [{'name': 'host.example.com'}]
-        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': 'tunnel_id', 'config': None}
+        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': TUNNEL_ID, 'config': None}
 
-        params = ZeroTrustParams(CachedApi(cf_mock), 'account_id', 'host.example.com', 'http://service:80',
-                                 'example.com', 'example_zone_id', 'tunnel_id',
-                                 None)
+        params = make_params(self.api, 'Host.Example.com')
         zones = {}
         tunnels = {}
         handle_start_event(zones, tunnels, params)
@@ -59,22 +91,31 @@ class TestEvents(unittest.TestCase):
         cf_mock.create_dns_record.assert_not_called()
 
     def test_start_ingress_already_exists(self):
-        cf_mock = Mock(CloudflareApi)
-        cf_mock.get_zone_id.return_value = 'example_zone_id'
-        cf_mock.get_dns_records.return_value = [{'name': 'host.example.com'}]
+        cf_mock.get_zone.return_value = {'id': ZONE_ID}
+        cf_mock.get_dns_records.return_value = [{'name': HOST}]
+        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': TUNNEL_ID, 'config': {'ingress': list(INGRESS)}}
+
+        params = make_params(self.api)
+        zones = {}
+        tunnels = {}
+        handle_start_event(zones, tunnels, params)
+        update_cloudflare(args, zones, tunnels)
+
+        cf_mock.update_tunnel_configs.assert_not_called()
+
+    def test_start_ingress_exists_different_case(self):
+        cf_mock.get_dns_records.return_value = [{'name': HOST}]
         cf_mock.get_tunnel_configs.return_value = {
-            'tunnel_id': 'tunnel_id',
+            'tunnel_id': TUNNEL_ID,
             'config': {
                 'ingress': [
-                    {'service': 'http://service:80', 'hostname': 'host.example.com', 'originRequest': {}},
-                    {'service': 'http_status:404'},
+                    {'service': SERVICE, 'hostname': 'Host.Example.com', 'originRequest': {}},
+                    CATCH_ALL,
                 ],
             },
         }
 
-        params = ZeroTrustParams(CachedApi(cf_mock), 'account_id', 'host.example.com', 'http://service:80',
-                                 'example.com', 'example_zone_id', 'tunnel_id',
-                                 None)
+        params = make_params(self.api)
         zones = {}
         tunnels = {}
         handle_start_event(zones, tunnels, params)
@@ -83,66 +124,55 @@ class TestEvents(unittest.TestCase):
         cf_mock.update_tunnel_configs.assert_not_called()
 
     def test_die(self):
-        cf_mock = Mock(CloudflareApi)
         cf_mock.get_dns_record_id.return_value = 'dns_record_id'
-        cf_mock.get_dns_records.return_value = [{'name': 'host.example.com'}]
-        cf_mock.get_tunnel_configs.return_value = {
-            'tunnel_id': 'tunnel_id',
-            'config': {
-                'ingress': [
-                    {'service': 'http://service:80', 'hostname': 'host.example.com', 'originRequest': {}},
-                    {'service': 'http_status:404'},
-                ],
-            },
-        }
+        cf_mock.get_dns_records.return_value = [{'name': HOST}]
+        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': TUNNEL_ID, 'config': {'ingress': list(INGRESS)}}
 
-        params = ZeroTrustParams(CachedApi(cf_mock), 'account_id', 'host.example.com', 'http://service:80',
-                                 'example.com', 'example_zone_id', 'tunnel_id',
-                                 None)
+        params = make_params(self.api)
         zones = {}
         tunnels = {}
         handle_die_event(zones, tunnels, params)
         update_cloudflare(args, zones, tunnels)
 
-        cf_mock.delete_dns_record.assert_called_once_with('example_zone_id', 'dns_record_id')
-        value = {
-            'config': {
-                'ingress': [
-                    {'service': 'http_status:404'},
-                ]
-            }
-        }
-        cf_mock.update_tunnel_configs.assert_called_once_with('account_id', 'tunnel_id', value)
+        cf_mock.delete_dns_record.assert_called_once_with(ZONE_ID, 'dns_record_id')
+        self.assertEqual(cf_mock.update_tunnel_configs.call_count, 1)
+        self.assertEqual(cf_mock.update_tunnel_configs.call_args.args[2], EXPECTED_EMPTY_VALUE)
+
+    def test_die_record_id_from_records(self):
+        cf_mock.get_dns_records.return_value = [{'name': HOST, 'id': 'dns_record_id'}]
+        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': TUNNEL_ID, 'config': None}
+
+        params = make_params(self.api)
+        zones = {}
+        tunnels = {}
+        handle_die_event(zones, tunnels, params)
+        update_cloudflare(args, zones, tunnels)
+
+        cf_mock.get_dns_record_id.assert_not_called()
+        cf_mock.delete_dns_record.assert_called_once_with(ZONE_ID, 'dns_record_id')
 
     def test_die_multiple(self):
-        cf_mock = Mock(CloudflareApi)
         cf_mock.get_dns_record_id.side_effect = ['dns_record_id3', 'dns_record_id']
         cf_mock.get_dns_records.return_value = []
         cf_mock.get_tunnel_configs.return_value = {
-            'tunnel_id': 'tunnel_id',
+            'tunnel_id': TUNNEL_ID,
             'config': {
                 'ingress': [
-                    {'service': 'http://service:80', 'hostname': 'host.example.com', 'originRequest': {}},
-                    {'service': 'http://service:80', 'hostname': 'host.example2.com', 'originRequest': {}},
-                    {'service': 'http://service:80', 'hostname': 'host.example3.com', 'originRequest': {}},
-                    {'service': 'http_status:404'},
+                    {'service': SERVICE, 'hostname': HOST, 'originRequest': {}},
+                    {'service': SERVICE, 'hostname': 'host.example2.com', 'originRequest': {}},
+                    {'service': SERVICE, 'hostname': 'host.example3.com', 'originRequest': {}},
+                    CATCH_ALL,
                 ],
             },
         }
 
-        api = CachedApi(cf_mock)
-
         params = [
-            ZeroTrustParams(api, 'account_id', 'host.example3.com', 'http://service:80', 'example3.com',
-                            'example3_zone_id', 'tunnel_id',
-                            None),
-            ZeroTrustParams(api, 'account_id', 'host.example.com', 'http://service:80', 'example.com',
-                            'example_zone_id', 'tunnel_id',
-                            None),
+            make_params(self.api, 'host.example3.com', 'example3.com', 'example3_zone_id'),
+            make_params(self.api),
         ]
 
-        zones = OrderedDict()
-        tunnels = OrderedDict()
+        zones = {}
+        tunnels = {}
         for pp in params:
             handle_die_event(zones, tunnels, pp)
         update_cloudflare(args, zones, tunnels)
@@ -155,75 +185,302 @@ class TestEvents(unittest.TestCase):
         # for zone in zones.values():
         #     zone.update_cloudflare(args)
 
-        cf_mock.delete_dns_record.assert_has_calls([
+        self.assertEqual(cf_mock.delete_dns_record.call_args_list, [
             call('example3_zone_id', 'dns_record_id3'),
-            call('example_zone_id', 'dns_record_id'),
+            call(ZONE_ID, 'dns_record_id'),
         ])
 
-        value = {
-            'config': {
-                'ingress': [
-                    {'service': 'http://service:80', 'hostname': 'host.example2.com', 'originRequest': {}},
-                    {'service': 'http_status:404'},
-                ]
-            }
-        }
-        cf_mock.update_tunnel_configs.assert_has_calls([
-            call('account_id', 'tunnel_id', value),
+        self.assertEqual(cf_mock.update_tunnel_configs.call_count, 1)
+        self.assertEqual(cf_mock.update_tunnel_configs.call_args.args[2]['config']['ingress'], [
+            {'service': SERVICE, 'hostname': 'host.example2.com', 'originRequest': {}},
+            CATCH_ALL,
         ])
 
+    def test_die_multiple_same_zone(self):
+        cf_mock.get_dns_records.return_value = [{'name': HOST, 'id': 'dns_record_id'},
+                                                {'name': 'host2.example.com', 'id': 'dns_record_id2'}]
+        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': TUNNEL_ID, 'config': None}
+
+        zones = {}
+        tunnels = {}
+        handle_die_event(zones, tunnels, make_params(self.api))
+        handle_die_event(zones, tunnels, make_params(self.api, 'host2.example.com'))
+        update_cloudflare(args, zones, tunnels)
+
+        cf_mock.delete_dns_records.assert_called_once_with(ZONE_ID, ['dns_record_id', 'dns_record_id2'])
+        cf_mock.delete_dns_record.assert_not_called()
+
     def test_die_cname_doesnt_exist(self):
-        cf_mock = Mock(CloudflareApi)
         cf_mock.get_dns_record_id.return_value = None
         cf_mock.get_dns_records.return_value = []
+        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': TUNNEL_ID, 'config': {'ingress': list(INGRESS)}}
+
+        params = make_params(self.api)
+        zones = {}
+        tunnels = {}
+        handle_die_event(zones, tunnels, params)
+        update_cloudflare(args, zones, tunnels)
+
+        cf_mock.delete_dns_record.assert_not_called()
+        cf_mock.update_tunnel_configs.assert_called_once_with(ACCOUNT_ID, TUNNEL_ID, EXPECTED_EMPTY_VALUE)
+
+    def test_die_ingress_doesnt_exist(self):
+        cf_mock.get_dns_record_id.return_value = 'dns_record_id'
+        cf_mock.get_dns_records.return_value = [{'name': HOST}]
         cf_mock.get_tunnel_configs.return_value = {
-            'tunnel_id': 'tunnel_id',
+            'tunnel_id': TUNNEL_ID,
             'config': {
                 'ingress': [
-                    {'service': 'http://service:80', 'hostname': 'host.example.com', 'originRequest': {}},
-                    {'service': 'http_status:404'},
+                    CATCH_ALL,
                 ],
             },
         }
 
-        params = ZeroTrustParams(CachedApi(cf_mock), 'account_id', 'host.example.com', 'http://service:80',
-                                 'example.com', 'example_zone_id', 'tunnel_id',
-                                 None)
+        params = make_params(self.api)
         zones = {}
         tunnels = {}
         handle_die_event(zones, tunnels, params)
         update_cloudflare(args, zones, tunnels)
 
-        cf_mock.delete_dns_record.assert_not_called()
-        value = {
-            'config': {
-                'ingress': [
-                    {'service': 'http_status:404'},
-                ]
-            }
-        }
-        cf_mock.update_tunnel_configs.assert_called_once_with('account_id', 'tunnel_id', value)
+        cf_mock.delete_dns_record.assert_called_once_with(ZONE_ID, 'dns_record_id')
+        cf_mock.update_tunnel_configs.assert_not_called()
 
-    def test_die_ingress_doesnt_exist(self):
-        cf_mock = Mock(CloudflareApi)
+    def test_die_path_rules(self):
         cf_mock.get_dns_record_id.return_value = 'dns_record_id'
-        cf_mock.get_dns_records.return_value = [{'name': 'host.example.com'}]
+        cf_mock.get_dns_records.return_value = [{'name': HOST}]
         cf_mock.get_tunnel_configs.return_value = {
-            'tunnel_id': 'tunnel_id',
+            'tunnel_id': TUNNEL_ID,
             'config': {
                 'ingress': [
-                    {'service': 'http_status:404'},
+                    {'service': SERVICE, 'hostname': HOST, 'path': '/api'},
+                    {'service': SERVICE, 'hostname': 'host.example2.com', 'originRequest': {}},
+                    {'service': SERVICE, 'hostname': 'HOST.example.com', 'originRequest': {}},
+                    CATCH_ALL,
                 ],
             },
         }
 
-        params = ZeroTrustParams(CachedApi(cf_mock), 'account_id', 'host.example.com', 'http://service:80',
-                                 'example.com', 'example_zone_id', 'tunnel_id',
-                                 None)
+        params = make_params(self.api)
+        zones = {}
+        tunnels = {}
+        handle_die_event(zones, tunnels, params)
+        update_cloudflare(args, zones, tunnels)
+
+        value = {
+            'config': {
+                'ingress': [
+                    {'service': SERVICE, 'hostname': 'host.example2.com', 'originRequest': {}},
+                    CATCH_ALL,
+                ]
+            }
+        }
+        cf_mock.update_tunnel_configs.assert_called_once_with(ACCOUNT_ID, TUNNEL_ID, value)
+
+    def test_die_then_start(self):
+        cf_mock.get_dns_records.return_value = [{'name': HOST, 'id': 'dns_record_id'}]
+        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': TUNNEL_ID, 'config': {'ingress': list(INGRESS)}}
+
+        params = make_params(self.api)
         zones = {}
         tunnels = {}
         handle_die_event(zones, tunnels, params)
+        handle_start_event(zones, tunnels, params)
         update_cloudflare(args, zones, tunnels)
 
-        cf_mock.delete_dns_record.assert_called_once_with('example_zone_id', 'dns_record_id')
+        cf_mock.delete_dns_record.assert_not_called()
+        cf_mock.create_dns_record.assert_not_called()
+
+    def test_die_then_start_mixed_case(self):
+        cf_mock.get_dns_records.return_value = [{'name': HOST, 'id': 'dns_record_id'}]
+        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': TUNNEL_ID, 'config': {'ingress': list(INGRESS)}}
+
+        zones = {}
+        tunnels = {}
+        handle_die_event(zones, tunnels, make_params(self.api, 'Host.example.com'))
+        handle_start_event(zones, tunnels, make_params(self.api))
+        update_cloudflare(args, zones, tunnels)
+
+        cf_mock.delete_dns_record.assert_not_called()
+        cf_mock.create_dns_record.assert_not_called()
+
+    def test_start_then_die_with_shared_api(self):
+        cf_mock.get_dns_records.side_effect = [[], [{'name': HOST, 'id': 'dns_record_id'}]]
+        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': TUNNEL_ID, 'config': None}
+
+        params = make_params(self.api)
+        zones = {}
+        tunnels = {}
+        handle_start_event(zones, tunnels, params)
+        update_cloudflare(args, zones, tunnels)
+
+        zones = {}
+        tunnels = {}
+        handle_die_event(zones, tunnels, params)
+        update_cloudflare(args, zones, tunnels)
+
+        self.assertEqual(cf_mock.get_dns_records.call_count, 2)
+        self.assertEqual(cf_mock.get_tunnel_configs.call_count, 2)
+        cf_mock.get_dns_record_id.assert_not_called()
+        cf_mock.delete_dns_record.assert_called_once_with(ZONE_ID, 'dns_record_id')
+
+    def test_ingress_refetched_each_batch(self):
+        dashboard_entry = {'service': SERVICE, 'hostname': 'dashboard.example.com', 'originRequest': {}}
+        cf_mock.get_dns_records.return_value = [{'name': HOST, 'id': 'dns_record_id'}]
+        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': TUNNEL_ID, 'config': {'ingress': list(INGRESS)}}
+
+        zones = {}
+        tunnels = {}
+        handle_start_event(zones, tunnels, make_params(self.api))
+        update_cloudflare(args, zones, tunnels)
         cf_mock.update_tunnel_configs.assert_not_called()
+
+        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': TUNNEL_ID, 'config': {'ingress': [
+            dashboard_entry, *INGRESS]}}
+        zones = {}
+        tunnels = {}
+        handle_start_event(zones, tunnels, make_params(self.api, 'host2.example.com'))
+        update_cloudflare(args, zones, tunnels)
+
+        ingress = cf_mock.update_tunnel_configs.call_args.args[2]['config']['ingress']
+        self.assertIn(dashboard_entry, ingress)
+
+    def test_ingress_order_preserved(self):
+        api_rule = {'service': 'http://api:80', 'hostname': 'other.example.com', 'path': '/api'}
+        other_rule = {'service': 'http://other:80', 'hostname': 'other.example.com'}
+        no_host_rule = {'service': 'http://default:80', 'path': '/status'}
+        cf_mock.get_dns_records.return_value = [{'name': HOST, 'id': 'dns_record_id'}]
+        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': TUNNEL_ID, 'config': {'ingress': [
+            api_rule, INGRESS[0], no_host_rule, other_rule, CATCH_ALL]}}
+
+        zones = {}
+        tunnels = {}
+        handle_die_event(zones, tunnels, make_params(self.api))
+        handle_start_event(zones, tunnels, make_params(self.api, 'host2.example.com'))
+        update_cloudflare(args, zones, tunnels)
+
+        self.assertEqual(cf_mock.update_tunnel_configs.call_args.args[2]['config']['ingress'], [
+            api_rule, no_host_rule, other_rule,
+            {'service': SERVICE, 'hostname': 'host2.example.com', 'originRequest': {}},
+            CATCH_ALL,
+        ])
+
+    def test_events_thread_skips_unlabeled(self):
+        labeled = {'id': 'c1', 'status': 'start', 'Actor': {'Attributes': {
+            'name': 'c1', A_NAME_LABEL: 'a.example.com'}}}
+        unlabeled = {'id': 'c2', 'status': 'start', 'Actor': {'Attributes': {'name': 'c2'}}}
+        queue = SimpleQueue()
+
+        docker_events_thread([unlabeled, labeled], queue)
+
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(queue.get_nowait(), labeled)
+
+    def test_events_thread_survives_malformed(self):
+        labeled = {'status': 'start', 'Actor': {'ID': 'c1', 'Attributes': {
+            'name': 'c1', A_NAME_LABEL: 'a.example.com'}}}
+        queue = SimpleQueue()
+
+        docker_events_thread([{'status': 'start'}, {'status': 'start', 'Actor': None}, 'garbage', labeled], queue)
+
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(queue.get_nowait(), labeled)
+
+    def test_event_batch(self):
+        queue = SimpleQueue()
+        queue.put({'status': 'die', 'Actor': {'ID': 'c1'}})
+        queue.put({'status': 'start', 'Actor': {'ID': 'c2'}})
+        queue.put({'status': 'start', 'Actor': {'ID': 'c1'}})
+
+        events = get_event_batch(queue, 0.01)
+
+        self.assertEqual(events, [{'status': 'start', 'Actor': {'ID': 'c1'}},
+                                  {'status': 'start', 'Actor': {'ID': 'c2'}}])
+
+    def test_event_batch_skips_invalid(self):
+        queue = SimpleQueue()
+        queue.put({'id': 'c1', 'status': 'start'})
+        queue.put({'status': 'start', 'Actor': {'ID': 'c2'}})
+
+        with self.assertLogs('cf-mgr.main', logging.ERROR):
+            events = get_event_batch(queue, 0.01)
+
+        self.assertEqual(events, [{'status': 'start', 'Actor': {'ID': 'c2'}}])
+
+    def test_handle_events(self):
+        cf_mock.get_zones.return_value = [{'id': ZONE_ID, 'name': ZONE}]
+        cf_mock.get_dns_records.return_value = [{'name': 'old.example.com', 'id': 'dns_record_id'}]
+        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': TUNNEL_ID, 'config': None}
+
+        events = [
+            {'status': 'start', 'Actor': {'Attributes': {
+                'name': 'c1',
+                ZT_HOSTNAME_LABEL: HOST,
+                ZT_SERVICE_LABEL: SERVICE,
+            }}},
+            {'status': 'die', 'Actor': {'Attributes': {
+                'name': 'c2',
+                A_NAME_LABEL: 'old.example.com',
+                A_IP_LABEL: '127.0.0.1',
+            }}},
+            {'status': 'start', 'Actor': {'Attributes': {'name': 'c3', 'foo': 'bar'}}},
+        ]
+        zones = {}
+        tunnels = {}
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            handle_events(executor, self.api, Settings(ACCOUNT_ID, TUNNEL_ID, False, None, None),
+                          zones, tunnels, events)
+        update_cloudflare(args, zones, tunnels)
+
+        cf_mock.get_dns_records.assert_called_once_with(ZONE_ID)
+        cf_mock.create_dns_record.assert_called_once_with(DnsRecordType.CNAME, ZONE_ID, HOST,
+                                                          'tunnel_id.cfargotunnel.com', True)
+        cf_mock.delete_dns_record.assert_called_once_with(ZONE_ID, 'dns_record_id')
+
+    def test_handle_events_tunnel_failure_logged(self):
+        cf_mock.get_zones.return_value = [{'id': ZONE_ID, 'name': ZONE}]
+        cf_mock.get_dns_records.return_value = []
+        cf_mock.get_tunnel_configs.return_value = None
+
+        events = [{'status': 'start', 'Actor': {'Attributes': {
+            'name': 'c1',
+            ZT_HOSTNAME_LABEL: HOST,
+            ZT_SERVICE_LABEL: SERVICE,
+        }}}]
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            with self.assertLogs('cf-mgr.main', logging.ERROR) as logs:
+                handle_events(executor, self.api, Settings(ACCOUNT_ID, TUNNEL_ID, False, None, None), {}, {}, events)
+
+        self.assertIn(f'tunnel "{TUNNEL_ID}"', logs.output[0])
+
+    def test_update_cloudflare_parallel(self):
+        def delete_dns_record(zone_id, _record_id):
+            if zone_id == 'example3_zone_id':
+                raise Exception('delete failed')
+            return True
+
+        cf_mock.get_dns_records.return_value = [{'name': HOST, 'id': 'dns_record_id'},
+                                                {'name': 'host.example3.com', 'id': 'dns_record_id3'}]
+        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': TUNNEL_ID, 'config': {'ingress': list(INGRESS)}}
+        cf_mock.delete_dns_record.side_effect = delete_dns_record
+
+        zones = {}
+        tunnels = {}
+        handle_die_event(zones, tunnels, make_params(self.api, 'host.example3.com', 'example3.com', 'example3_zone_id'))
+        handle_die_event(zones, tunnels, make_params(self.api))
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            with self.assertRaisesRegex(Exception, 'delete failed'):
+                update_cloudflare(args, zones, tunnels, executor)
+
+        self.assertCountEqual(cf_mock.delete_dns_record.call_args_list, [
+            call('example3_zone_id', 'dns_record_id3'),
+            call(ZONE_ID, 'dns_record_id'),
+        ])
+        cf_mock.update_tunnel_configs.assert_called_once_with(ACCOUNT_ID, TUNNEL_ID, EXPECTED_EMPTY_VALUE)
+
+    def test_event_batch_max(self):
+        queue = SimpleQueue()
+        for ii in range(3):
+            queue.put({'status': 'start', 'Actor': {'ID': f'c{ii}'}})
+
+        self.assertEqual(len(get_event_batch(queue, 0.01, max_batch=2)), 2)
+        self.assertEqual(get_event_batch(queue, 0.01, max_batch=2), [{'status': 'start', 'Actor': {'ID': 'c2'}}])
@@ -1,39 +1,87 @@
 import logging
 import unittest
-from unittest.mock import Mock
+from unittest.mock import create_autospec, patch
 
 from cloudflare_manager.cloudflare_api import CloudflareApi, DnsRecordType
-from cloudflare_manager.api import Api, CachedApi
+from cloudflare_manager.api import Api, CachedApi, NEGATIVE_CACHE_TTL
+from cloudflare_manager.labels import LabelError, Settings, split_names, validate_notlsverify, validate_service, \
+    A_IP_LABEL, A_NAME_LABEL, ZT_HOSTNAME_LABEL, ZT_NOTLSVERIFY_LABEL, ZT_SERVICE_LABEL, ZT_TUNNEL_ID_LABEL
 from cloudflare_manager.main import get_params_from_labels
 
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s|%(name)s|%(levelname)s|%(message)s')
+cf_mock = create_autospec(CloudflareApi, instance=True, spec_set=True)
 
-cf_mock = Mock(CloudflareApi)
-cf_mock.get_zone_id.return_value = 'example_zone_id'
+settings = Settings('account_id', 'tunnel', False, None, None)
 
 valid_labels = {
-    'cloudflare.zero_trust.access.tunnel.public_hostname': 'host.example.com',
-    'cloudflare.zero_trust.access.tunnel.service': 'http://foo:80',
+    ZT_HOSTNAME_LABEL: 'host.example.com',
+    ZT_SERVICE_LABEL: 'http://foo:80',
 }
 
 
 class TestLabels(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.getLogger().setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        cf_mock.reset_mock(return_value=True, side_effect=True)
+        cf_mock.get_zone.return_value = {'id': 'example_zone_id'}
+
     def test_bad_hostname(self):
         labels = {
-            'cloudflare.zero_trust.access.tunnel.public_hostname': 'host',
-            'cloudflare.zero_trust.access.tunnel.service': 'http://foo:80',
+            ZT_HOSTNAME_LABEL: 'host',
+            ZT_SERVICE_LABEL: 'http://foo:80',
+        }
+        with self.assertRaises(LabelError):
+            get_params_from_labels(Api(cf_mock), settings, labels)
+
+    def test_bad_hostname_characters(self):
+        for hostname in ('host name.example.com', 'host.example.com/path', 'host..example.com', 'host.*.example.com',
+                         '*.com', 'host.example.com..',
+                         'a' * 64 + '.example.com', 'a.' * 125 + 'example.com'):
+            labels = {
+                ZT_HOSTNAME_LABEL: hostname,
+                ZT_SERVICE_LABEL: 'http://foo:80',
+            }
+            with self.assertRaises(LabelError):
+                get_params_from_labels(Api(cf_mock), settings, labels)
+
+    def test_wildcard_hostname(self):
+        labels = {
+            ZT_HOSTNAME_LABEL: '*.example.com',
+            ZT_SERVICE_LABEL: 'http://foo:80',
         }
-        with self.assertRaises(Exception):
-            get_params_from_labels(Api(cf_mock), 'account_id', 'tunnel', labels)
+        params = get_params_from_labels(Api(cf_mock), settings, labels)
+        self.assertEqual(params[0].hostname, '*.example.com')
+        self.assertEqual(params[0].zone_name, 'example.com')
+
+    def test_fully_qualified_hostname(self):
+        labels = {
+            ZT_HOSTNAME_LABEL: 'host.example.com.',
+            ZT_SERVICE_LABEL: 'http://foo:80',
+        }
+        params = get_params_from_labels(Api(cf_mock), settings, labels)
+        self._assert_valid(params, 'tunnel', 'example_zone_id', None)
+
+    def test_hostname_length_limits(self):
+        longest = '.'.join(['a' * 63] * 3 + ['a' * 61])
+        self.assertEqual(split_names('*.example.com'), ('*.example.com',))
+        self.assertEqual(split_names(longest), (longest,))
+        self.assertEqual(split_names(longest + '.'), (longest,))
+        for hostname in ('a' + longest, '*.' + 'a' * 64 + '.example.com', '*.' + longest):
+            with self.assertRaises(LabelError):
+                split_names(hostname)
 
     def test_bad_service(self):
         labels = {
-            'cloudflare.zero_trust.access.tunnel.public_hostname': 'host.example.com',
-            'cloudflare.zero_trust.access.tunnel.service': 'foo://service',
+            ZT_HOSTNAME_LABEL: 'host.example.com',
+            ZT_SERVICE_LABEL: 'foo://service',
         }
-        with self.assertRaises(Exception):
-            get_params_from_labels(Api(cf_mock), 'account_id', 'tunnel', labels)
+        with self.assertRaises(LabelError):
+            get_params_from_labels(Api(cf_mock), settings, labels)
+
+        with self.assertRaises(LabelError):
+            validate_service('http://service\n')
 
     def _assert_valid(self, params, tunnel_id, zone_id, notlsverify):
         if len(params) > 0:
@@ -43,6 +91,7 @@ class TestLabels(unittest.TestCase):
             self.assertEqual(pp.service, 'http://foo:80')
             self.assertEqual(pp.notlsverify, notlsverify)
             self.assertEqual(pp.tunnel_id, tunnel_id)
+            self.assertEqual(pp.cname_target, f'{tunnel_id}.cfargotunnel.com')
             self.assertEqual(pp.zone_name, 'example.com')
             self.assertEqual(pp.zone_id, zone_id)
         if len(params) > 1:
@@ -52,6 +101,7 @@ class TestLabels(unittest.TestCase):
             self.assertEqual(pp.service, 'http://foo:80')
             self.assertEqual(pp.notlsverify, notlsverify)
             self.assertEqual(pp.tunnel_id, tunnel_id)
+            self.assertEqual(pp.cname_target, f'{tunnel_id}.cfargotunnel.com')
             self.assertEqual(pp.zone_name, 'example.com')
             self.assertEqual(pp.zone_id, zone_id)
         if len(params) > 2:
@@ -61,45 +111,126 @@ class TestLabels(unittest.TestCase):
             self.assertEqual(pp.service, 'http://foo:80')
             self.assertEqual(pp.notlsverify, notlsverify)
             self.assertEqual(pp.tunnel_id, tunnel_id)
+            self.assertEqual(pp.cname_target, f'{tunnel_id}.cfargotunnel.com')
             self.assertEqual(pp.zone_name, 'domain.com')
             self.assertEqual(pp.zone_id, 'domain_zone_id')
 
     def test_valid(self):
         labels = valid_labels
-        params = get_params_from_labels(Api(cf_mock), 'account_id', 'tunnel', labels)
+        params = get_params_from_labels(Api(cf_mock), settings, labels)
+        self._assert_valid(params, 'tunnel', 'example_zone_id', None)
+
+    def test_params_have_no_dict(self):
+        labels = valid_labels.copy()
+        labels[A_NAME_LABEL] = 'a.example.com'
+        labels[A_IP_LABEL] = '127.0.0.1'
+        params = get_params_from_labels(Api(cf_mock), settings, labels)
+        self.assertEqual(len(params), 2)
+        for pp in params:
+            self.assertFalse(hasattr(pp, '__dict__'))
+        self.assertFalse(hasattr(params[0].dns_params, '__dict__'))
+
+    def test_valid_duplicate_hostnames(self):
+        labels = valid_labels.copy()
+        labels[ZT_HOSTNAME_LABEL] = 'host.example.com, host.example.com,'
+        params = get_params_from_labels(Api(cf_mock), settings, labels)
+        self.assertEqual(len(params), 1)
         self._assert_valid(params, 'tunnel', 'example_zone_id', None)
 
     def test_valid_with_cached_zone(self):
         labels = valid_labels
         api = CachedApi(cf_mock)
-        api._zone_name_to_id = {('example.com',): 'example_zone_id_cached'}
-        params = get_params_from_labels(api, 'account_id', 'tunnel', labels)
+        api._zones_by_name = {'example.com': {'id': 'example_zone_id_cached'}}
+        params = get_params_from_labels(api, settings, labels)
         self._assert_valid(params, 'tunnel', 'example_zone_id_cached', None)
 
+    def test_missing_zone_cached(self):
+        cf_mock.get_zones.return_value = []
+        cf_mock.get_zone.return_value = None
+        api = CachedApi(cf_mock)
+        raised = []
+        for _ in range(2):
+            with self.assertRaises(Exception) as ctx:
+                get_params_from_labels(api, settings, valid_labels)
+            raised.append(ctx.exception)
+        cf_mock.get_zone.assert_called_once_with('example.com')
+        self.assertIsNot(raised[0], raised[1])
+        self.assertEqual(str(raised[0]), str(raised[1]))
+
+    def test_missing_zone_retried_after_negative_ttl(self):
+        cf_mock.get_zones.return_value = []
+        cf_mock.get_zone.return_value = None
+        api = CachedApi(cf_mock)
+        with patch('cloudflare_manager.api.time.monotonic', return_value=100.0) as monotonic_mock:
+            for _ in range(2):
+                with self.assertRaises(Exception):
+                    get_params_from_labels(api, settings, valid_labels)
+            cf_mock.get_zone.assert_called_once_with('example.com')
+
+            monotonic_mock.return_value += NEGATIVE_CACHE_TTL
+            cf_mock.get_zone.return_value = {'id': 'example_zone_id'}
+            params = get_params_from_labels(api, settings, valid_labels)
+        self._assert_valid(params, 'tunnel', 'example_zone_id', None)
+
+    def test_zones_listed_once(self):
+        labels = valid_labels.copy()
+        labels[ZT_HOSTNAME_LABEL] = 'host.example.com,example.com,foo.domain.com'
+
+        cf_mock.get_zones.return_value = [{'id': 'example_zone_id', 'name': 'example.com'},
+                                          {'id': 'domain_zone_id', 'name': 'domain.com'}]
+
+        params = get_params_from_labels(CachedApi(cf_mock), settings, labels)
+        self.assertEqual([pp.zone_id for pp in params], ['example_zone_id', 'example_zone_id', 'domain_zone_id'])
+        cf_mock.get_zones.assert_called_once_with()
+        cf_mock.get_zone.assert_not_called()
+
+    def test_missing_dns_records_cached(self):
+        cf_mock.get_dns_records.return_value = None
+        api = CachedApi(cf_mock)
+        for _ in range(2):
+            with self.assertRaises(Exception):
+                api.get_dns_records('example_zone_id')
+        cf_mock.get_dns_records.assert_called_once_with('example_zone_id')
+
     def test_valid_with_tunnel(self):
         labels = valid_labels.copy()
-        labels['cloudflare.zero_trust.access.tunnel.id'] = 'specified-tunnel'
-        params = get_params_from_labels(Api(cf_mock), 'account_id', 'tunnel', labels)
+        labels[ZT_TUNNEL_ID_LABEL] = 'specified-tunnel'
+        params = get_params_from_labels(Api(cf_mock), settings, labels)
         self._assert_valid(params, 'specified-tunnel', 'example_zone_id', None)
 
     def test_valid_with_notlsverify(self):
         labels = valid_labels.copy()
-        labels['cloudflare.zero_trust.access.tunnel.tls.notlsverify'] = 'true'
-        params = get_params_from_labels(Api(cf_mock), 'account_id', 'tunnel', labels)
+        labels[ZT_NOTLSVERIFY_LABEL] = 'true'
+        params = get_params_from_labels(Api(cf_mock), settings, labels)
         self._assert_valid(params, 'tunnel', 'example_zone_id', True)
 
+    def test_notlsverify_values(self):
+        for val in ('true', 'True', 'TRUE', 't', 'T', '1', True):
+            self.assertIs(validate_notlsverify(val), True)
+        for val in ('false', 'False', 'FALSE', 'f', 'F', '0', False):
+            self.assertIs(validate_notlsverify(val), False)
+        self.assertIsNone(validate_notlsverify(None))
+
+    def test_split_names_cached(self):
+        split_names.cache_clear()
+        self.assertEqual(split_names('a.example.com, b.example.com,a.example.com'), ('a.example.com', 'b.example.com'))
+        split_names('a.example.com, b.example.com,a.example.com')
+        self.assertEqual(split_names.cache_info().hits, 1)
+        self.assertEqual(split_names('a.example.com.,a.example.com'), ('a.example.com',))
+
     def test_valid_with_invalid_notlsverify(self):
         labels = valid_labels.copy()
-        labels['cloudflare.zero_trust.access.tunnel.tls.notlsverify'] = 'foo'
-        with self.assertRaises(Exception):
-            get_params_from_labels(Api(cf_mock), 'account_id', 'tunnel', labels)
+        labels[ZT_NOTLSVERIFY_LABEL] = 'foo'
+        with self.assertRaises(LabelError):
+            get_params_from_labels(Api(cf_mock), settings, labels)
 
     def test_valid_multiple_hostnams(self):
         labels = valid_labels.copy()
-        labels['cloudflare.zero_trust.access.tunnel.public_hostname'] = 'host.example.com,example.com,foo.domain.com'
+        labels[ZT_HOSTNAME_LABEL] = 'host.example.com,example.com,foo.domain.com'
 
-        cf_mock = Mock(CloudflareApi)
-        cf_mock.get_zone_id.side_effect = ['example_zone_id', 'example_zone_id', 'domain_zone_id']
+        zones = {'example.com': {'id': 'example_zone_id'}, 'domain.com': {'id': 'domain_zone_id'}}
+        cf_mock.get_zone.side_effect = lambda name: zones[name]
 
-        params = get_params_from_labels(Api(cf_mock), 'account_id', 'tunnel', labels)
+        params = get_params_from_labels(Api(cf_mock), settings, labels)
         self._assert_valid(params, 'tunnel', 'example_zone_id', None)
+        self.assertEqual(cf_mock.get_zone.call_count, 2)
@@ -1,153 +1,146 @@
-import argparse
-from copy import deepcopy
 import logging
 import unittest
-from typing import NamedTuple, Dict
-from unittest.mock import Mock, call
+from types import MappingProxyType, SimpleNamespace
+from typing import Mapping, NamedTuple
+from unittest.mock import call, create_autospec
 
 from cloudflare_manager.cloudflare_api import CloudflareApi, DnsRecordType
 from cloudflare_manager.api import CachedApi
+from cloudflare_manager.labels import Settings, A_IP_LABEL, A_NAME_LABEL, CNAME_NAME_LABEL, CNAME_TARGET_LABEL, \
+    ZT_HOSTNAME_LABEL, ZT_SERVICE_LABEL
 from cloudflare_manager.main import load_containers
 
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s|%(name)s|%(levelname)s|%(message)s')
+ACCOUNT_ID = 'account_id'
+TUNNEL_ID = 'tunnel_id'
+TUNNEL_TARGET = 'tunnel_id.cfargotunnel.com'
+ZONE_ID = 'example_zone_id'
 
-args = argparse.Namespace(dry_run=False)
+args = SimpleNamespace(dry_run=False, workers=8)
+settings = Settings(ACCOUNT_ID, TUNNEL_ID, False, None, None)
+
+cf_mock = create_autospec(CloudflareApi, instance=True, spec_set=True)
 
 
 class Container(NamedTuple):
     name: str
     status: str
-    labels: Dict[str, str]
-
-
-containers = [
-    Container('c1', 'running',
-              {
-                  'cloudflare.zero_trust.access.tunnel.public_hostname': 'host.example.com',
-                  'cloudflare.zero_trust.access.tunnel.service': 'http://service:80',
-                  'cloudflare.dns.cname.name': 'cname.example.com',
-                  'cloudflare.dns.cname.target': 'target.example.com',
-                  'cloudflare.dns.a.name': 'a.example.com',
-                  'cloudflare.dns.a.ip': '127.0.0.1',
-              }
-              ),
-    Container('c2', 'running', {'foo': 'bar'}),
-    Container('c3', 'stopped', {}),
-]
+    labels: Mapping[str, str]
+
+
+CONTAINERS = (
+    Container('c1', 'running', MappingProxyType({
+        ZT_HOSTNAME_LABEL: 'host.example.com',
+        ZT_SERVICE_LABEL: 'http://service:80',
+        CNAME_NAME_LABEL: 'cname.example.com',
+        CNAME_TARGET_LABEL: 'target.example.com',
+        A_NAME_LABEL: 'a.example.com',
+        A_IP_LABEL: '127.0.0.1',
+    })),
+    Container('c2', 'running', MappingProxyType({'foo': 'bar'})),
+    Container('c3', 'stopped', MappingProxyType({})),
+)
+
+HOST_CALL = call(DnsRecordType.CNAME, ZONE_ID, 'host.example.com', TUNNEL_TARGET, True)
+ZONE_APEX_CALL = call(DnsRecordType.CNAME, ZONE_ID, 'example.com', TUNNEL_TARGET, True)
+EXPECTED_CALLS = (
+    HOST_CALL,
+    call(DnsRecordType.CNAME, ZONE_ID, 'cname.example.com', 'target.example.com', False),
+    call(DnsRecordType.A, ZONE_ID, 'a.example.com', '127.0.0.1', False),
+)
+HOST_INGRESS = {'service': 'http://service:80', 'hostname': 'host.example.com', 'originRequest': {}}
+CATCH_ALL = {'service': 'http_status:404'}
 
 
 class TestLoadContainers(unittest.TestCase):
-    def test_load(self):
-        cf_mock = Mock(CloudflareApi)
-        cf_mock.get_zone_id.return_value = 'example_zone_id'
+    @classmethod
+    def setUpClass(cls):
+        logging.getLogger().setLevel(logging.CRITICAL)
+        cls.api = CachedApi(cf_mock)
+
+    def setUp(self):
+        cf_mock.reset_mock(return_value=True, side_effect=True)
+        self.api.clear()
+        cf_mock.get_zones.return_value = [{'id': ZONE_ID, 'name': 'example.com'}]
         cf_mock.get_dns_records.return_value = []
-        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': 'tunnel_id', 'config': None}
-
-        load_containers(args, containers, CachedApi(cf_mock), 'account_id', 'tunnel_id')
+        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': TUNNEL_ID, 'config': None}
+        cf_mock.create_dns_record.return_value = True
+        cf_mock.update_tunnel_configs.return_value = True
 
-        cf_mock.create_dns_record.assert_has_calls([
-            call(DnsRecordType.CNAME, 'example_zone_id', 'host.example.com', 'tunnel_id.cfargotunnel.com', True),
-            call(DnsRecordType.CNAME, 'example_zone_id', 'cname.example.com', 'target.example.com', False),
-            call(DnsRecordType.A, 'example_zone_id', 'a.example.com', '127.0.0.1', False),
-        ])
+    def test_load(self):
+        load_containers(args, CONTAINERS, self.api, settings)
 
-        value = {
-            'config': {
-                'ingress': [
-                    {'service': 'http://service:80', 'hostname': 'host.example.com', 'originRequest': {}},
-                    {'service': 'http_status:404'},
-                ]
-            }
-        }
-        cf_mock.update_tunnel_configs.assert_called_once_with('account_id', 'tunnel_id', value)
+        self.assertCountEqual(cf_mock.create_dns_record.call_args_list, EXPECTED_CALLS)
+        cf_mock.update_tunnel_configs.assert_called_once_with(ACCOUNT_ID, TUNNEL_ID,
+                                                              {'config': {'ingress': [HOST_INGRESS, CATCH_ALL]}})
 
     def test_load_multiple(self):
-        cf_mock = Mock(CloudflareApi)
-        cf_mock.get_zone_id.return_value = 'example_zone_id'
-        cf_mock.get_dns_records.return_value = []
-        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': 'tunnel_id', 'config': None}
-
-        global containers
-        containers_copy = containers.copy()
-        containers_copy.append(Container('c4', 'running',
-                                         {
-                                             'cloudflare.zero_trust.access.tunnel.public_hostname': 'host2.example.com',
-                                             'cloudflare.zero_trust.access.tunnel.service': 'http://service2:80',
-                                         }
-                                         ))
-
-        load_containers(args, containers_copy, CachedApi(cf_mock), 'account_id', 'tunnel_id')
-
-        cf_mock.create_dns_record.assert_has_calls([
-            call(DnsRecordType.CNAME, 'example_zone_id', 'host.example.com', 'tunnel_id.cfargotunnel.com', True),
-            call(DnsRecordType.CNAME, 'example_zone_id', 'cname.example.com', 'target.example.com', False),
-            call(DnsRecordType.A, 'example_zone_id', 'a.example.com', '127.0.0.1', False),
-            call(DnsRecordType.CNAME, 'example_zone_id', 'host2.example.com', 'tunnel_id.cfargotunnel.com', True),
+        containers = [*CONTAINERS, Container('c4', 'running', {
+            ZT_HOSTNAME_LABEL: 'host2.example.com',
+            ZT_SERVICE_LABEL: 'http://service2:80',
+        })]
+
+        load_containers(args, containers, self.api, settings)
+
+        self.assertCountEqual(cf_mock.create_dns_record.call_args_list, [
+            *EXPECTED_CALLS,
+            call(DnsRecordType.CNAME, ZONE_ID, 'host2.example.com', TUNNEL_TARGET, True),
         ])
         value = {
             'config': {
                 'ingress': [
-                    {'service': 'http://service:80', 'hostname': 'host.example.com', 'originRequest': {}},
+                    HOST_INGRESS,
                     {'service': 'http://service2:80', 'hostname': 'host2.example.com', 'originRequest': {}},
-                    {'service': 'http_status:404'},
+                    CATCH_ALL,
                 ]
             }
         }
-        cf_mock.update_tunnel_configs.assert_called_once_with('account_id', 'tunnel_id', value)
+        cf_mock.update_tunnel_configs.assert_called_once_with(ACCOUNT_ID, TUNNEL_ID, value)
+        ingress = cf_mock.update_tunnel_configs.call_args.args[2]['config']['ingress']
+        self.assertIs(ingress[0]['originRequest'], ingress[1]['originRequest'])
 
     def test_load_multiple_hostnames(self):
-        cf_mock = Mock(CloudflareApi)
-        cf_mock.get_zone_id.return_value = 'example_zone_id'
-        cf_mock.get_dns_records.return_value = []
-        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': 'tunnel_id', 'config': None}
-
-        global containers
-        containers_copy = deepcopy(containers)
-        containers_copy[0].labels[
-            'cloudflare.zero_trust.access.tunnel.public_hostname'] = 'host.example.com,example.com'
+        labels = {**CONTAINERS[0].labels, ZT_HOSTNAME_LABEL: 'host.example.com,example.com'}
+        containers = [CONTAINERS[0]._replace(labels=labels), *CONTAINERS[1:]]
 
-        load_containers(args, containers_copy, CachedApi(cf_mock), 'account_id', 'tunnel_id')
+        load_containers(args, containers, self.api, settings)
 
-        cf_mock.create_dns_record.assert_has_calls([
-            call(DnsRecordType.CNAME, 'example_zone_id', 'host.example.com', 'tunnel_id.cfargotunnel.com', True),
-            call(DnsRecordType.CNAME, 'example_zone_id', 'example.com', 'tunnel_id.cfargotunnel.com', True),
-        ])
+        self.assertCountEqual(cf_mock.create_dns_record.call_args_list, [*EXPECTED_CALLS, ZONE_APEX_CALL])
 
         value = {
             'config': {
                 'ingress': [
-                    {'service': 'http://service:80', 'hostname': 'host.example.com', 'originRequest': {}},
+                    HOST_INGRESS,
                     {'service': 'http://service:80', 'hostname': 'example.com', 'originRequest': {}},
-                    {'service': 'http_status:404'},
+                    CATCH_ALL,
                 ]
             }
         }
-        cf_mock.update_tunnel_configs.assert_called_once_with('account_id', 'tunnel_id', value)
+        cf_mock.update_tunnel_configs.assert_called_once_with(ACCOUNT_ID, TUNNEL_ID, value)
+
+    def test_load_multiple_hostnames_with_spaces(self):
+        labels = {**CONTAINERS[0].labels, ZT_HOSTNAME_LABEL: ' host.example.com , example.com,,'}
+        containers = [CONTAINERS[0]._replace(labels=labels)]
+
+        load_containers(args, containers, self.api, settings)
+
+        self.assertCountEqual(cf_mock.create_dns_record.call_args_list, [*EXPECTED_CALLS, ZONE_APEX_CALL])
+        ingress = cf_mock.update_tunnel_configs.call_args.args[2]['config']['ingress']
+        self.assertEqual([ii.get('hostname') for ii in ingress], ['host.example.com', 'example.com', None])
 
     def test_load_dns_record_already_exists(self):
-        cf_mock = Mock(CloudflareApi)
-        cf_mock.get_zone_id.return_value = 'example_zone_id'
         cf_mock.get_dns_records.return_value = [{'name': 'host.example.com'}, {'name': 'cname.example.com'},
                                                 {'name': 'a.example.com'}]
-        cf_mock.get_tunnel_configs.return_value = {'tunnel_id': 'tunnel_id', 'config': None}
 
-        load_containers(args, containers, CachedApi(cf_mock), 'account_id', 'tunnel_id')
+        load_containers(args, CONTAINERS, self.api, settings)
         cf_mock.create_dns_record.assert_not_called()
 
     def test_load_ingress_already_exists(self):
-        cf_mock = Mock(CloudflareApi)
-        cf_mock.get_zone_id.return_value = 'example_zone_id'
-        cf_mock.get_dns_records.return_value = []
         cf_mock.get_tunnel_configs.return_value = {
-            'tunnel_id': 'tunnel_id',
+            'tunnel_id': TUNNEL_ID,
             'config': {
-                'ingress': [
-                    {'service': 'http://service:80', 'hostname': 'host.example.com', 'originRequest': {}},
-                    {'service': 'http_status:404'},
-                ],
+                'ingress': [HOST_INGRESS, CATCH_ALL],
             },
         }
 
-        load_containers(args, containers, CachedApi(cf_mock), 'account_id', 'tunnel_id')
+        load_containers(args, CONTAINERS, self.api, settings)
         cf_mock.update_tunnel_configs.assert_not_called()